@@ -1,43 +1,117 @@
 """Helper functions for working with blender models"""
 
-from math import degrees, radians
+import logging
+from math import radians
 
 from pyapputil.logutil import GetLogger
 
+import numpy as np
 import bpy
 import bmesh  #type: ignore #pylint: disable=import-error
-from mathutils import Vector, Euler  #type: ignore #pylint: disable=import-error
+from mathutils import Euler  #type: ignore #pylint: disable=import-error
 
 METER_TO_INCH = 39.37007874
 
+# How close a face normal component must be to +/-1 to count as aligned with that axis
+AXIS_TOLERANCE = 1e-6
+
+# Faces that meet at less than this angle, in radians, are considered flat with each other
+COPLANAR_ANGLE = 0.0005
+
+# The axis and direction that each side of the model faces
+SIDE_AXES = {
+    "front": (1, -1),
+    "back": (1, 1),
+    "left": (0, -1),
+    "right": (0, 1),
+    "bottom": (2, -1),
+}
+
+# Name of the face attribute used to remember which side of the model each face is on
+SIDE_LAYER_NAME = "side_id"
+
+# The value stored in the side attribute for each side. Faces that have not been classified are 0
+SIDE_IDS = {
+    "front": 1,
+    "back": 2,
+    "left": 3,
+    "right": 4,
+    "bottom": 5,
+    "top": 6,
+}
+
 class ModeSet:
     """Context manager to set the context mode"""
     def __init__(self, new_mode):
-        self.old_mode = bpy.context.object.mode
+        self.old_mode = None
         self.new_mode = new_mode
     def __enter__(self):
         self.old_mode = bpy.context.object.mode
-        bpy.ops.object.mode_set(mode=self.new_mode)
+        # Switching to the mode we are already in still triggers an update, so skip it
+        if self.old_mode != self.new_mode:
+            bpy.ops.object.mode_set(mode=self.new_mode)
         return self.new_mode
     def __exit__(self, exc_type, exc_value, exc_tb):
-        bpy.ops.object.mode_set(mode=self.old_mode)
+        if self.old_mode != self.new_mode:
+            bpy.ops.object.mode_set(mode=self.old_mode)
+
+def read_array(collection, attr, dtype, width=1):
+    """Read an attribute of every item in a mesh data collection into an array"""
+    values = np.empty(len(collection) * width, dtype=dtype)
+    collection.foreach_get(attr, values)
+    return values.reshape(-1, width) if width > 1 else values
+
+class WorkingMesh:
+    """Lazily read mesh data arrays for an object and keep them until the geometry changes, so several helpers can
+    share one copy. Call refresh() after changing the mesh"""
+    def __init__(self, obj):
+        self.obj = obj
+        self._cache = {}
+    def refresh(self):
+        self._cache.clear()
+    def _get(self, name, read):
+        if name not in self._cache:
+            # The mesh data is only synced from the edit mesh when leaving edit mode, so sync it once per refresh
+            if not self._cache and self.obj.mode == "EDIT":
+                self.obj.update_from_editmode()
+            self._cache[name] = read(self.obj.data)
+        return self._cache[name]
+    @property
+    def face_normals(self):
+        return self._get("face_normals", lambda mesh: read_array(mesh.polygons, "normal", np.float32, 3))
+    @property
+    def loop_faces(self):
+        return self._get("loop_faces", get_loop_faces)
+    @property
+    def loop_edges(self):
+        return self._get("loop_edges", lambda mesh: read_array(mesh.loops, "edge_index", np.int32))
+    @property
+    def loop_verts(self):
+        return self._get("loop_verts", lambda mesh: read_array(mesh.loops, "vertex_index", np.int32))
+    @property
+    def side_ids(self):
+        return self._get("side_ids", lambda mesh: read_array(mesh.attributes[SIDE_LAYER_NAME].data, "value", np.int32))
 
 def get_obj():
-    with ModeSet("EDIT"):
-        bpy.ops.object.select_all(action='DESELECT')
-        for obj in bpy.context.view_layer.objects:
-            if obj.type == "MESH":
-                return obj
-        return None
+    mesh_obj = None
+    # Set the selection directly instead of going through the select_all operator
+    for obj in bpy.context.view_layer.objects:
+        obj.select_set(False)
+        if mesh_obj is None and obj.type == "MESH":
+            mesh_obj = obj
+    return mesh_obj
 
 def select_obj():
-    bpy.ops.object.select_all(action='DESELECT')
+    mesh_obj = None
+    # Set the selection directly instead of going through the select_all operator
     for obj in bpy.context.view_layer.objects:
-        if obj.type == "MESH":
+        if mesh_obj is None and obj.type == "MESH":
+            mesh_obj = obj
             bpy.context.view_layer.objects.active = obj
             obj.select_set(True)
-            return obj
-    return None
+        else:
+            obj.select_set(False)
+    return mesh_obj
 
 def get_obj_dimensions(obj):
     return obj.dimensions[0] * METER_TO_INCH, obj.dimensions[1] * METER_TO_INCH, obj.dimensions[2] * METER_TO_INCH
@@ -47,181 +121,178 @@ def resize_obj(obj, scale):
     bpy.ops.object.transform_apply(location=False, rotation=False, scale=True)
 
 def select_bottom_faces(obj):
+    with ModeSet("OBJECT"):
+        # Any face pointing less than 90 degrees away from straight down is part of the bottom
+        select_faces(obj, get_face_normals(obj)[:, 2] < 0)
     with ModeSet("EDIT"):
         bm = bmesh.from_edit_mesh(obj.data)
         bm.select_mode = {'FACE'}
-        down_vec = Vector([0,0,-1])
-        for face in bm.faces:
-            ang = degrees(face.normal.angle(down_vec))
-            if ang >= 0 and ang < 90:
-                face.select_set(True)
-            else:
-                face.select_set(False)
         bm.select_flush_mode()
         bmesh.update_edit_mesh(obj.data)
 
 def select_bottom_edges(obj):
+    with ModeSet("OBJECT"):
+        # Any face pointing less than 90 degrees away from straight down is part of the bottom
+        select_faces(obj, get_face_normals(obj)[:, 2] < 0)
     with ModeSet("EDIT"):
         bm = bmesh.from_edit_mesh(obj.data)
         bm.select_mode = {'EDGE', 'FACE'}
-        down_vec = Vector([0,0,-1])
-        for face in bm.faces:
-            ang = degrees(face.normal.angle(down_vec))
-            if ang >= 0 and ang < 90:
-                face.select_set(True)
-            else:
-                face.select_set(False)
         bm.select_flush_mode()
         bmesh.update_edit_mesh(obj.data)
 
-def get_bottom_faces(obj_mesh):
-    with ModeSet("EDIT"):
-        down_vec = Vector([0,0,-1])
-        # Find all faces that are less than 90 degrees away from a straight down vector
-        bottom = []
-        for face in obj_mesh.faces:
-            ang = degrees(face.normal.angle(down_vec))
-            if ang >= 0 and ang < 90:
-                bottom.append(face)
-        return bottom
-
-def get_top_faces(obj_mesh):
-    with ModeSet("EDIT"):
-        up_vec = Vector([0,0,1])
-        # Find all faces that are less than 90 degrees away from a straight up vector
-        top = []
-        for face in obj_mesh.faces:
-            ang = degrees(face.normal.angle(up_vec))
-            if ang >= 0 and ang < 90:
-                top.append(face)
-        return top
-
-def get_side_faces(obj_mesh):
-    with ModeSet("EDIT"):
-        vectors = {
-            "front": Vector([0, -1, 0]),
-            "back": Vector([0, 1, 0]),
-            "left": Vector([-1, 0, 0]),
-            "right": Vector([1, 0, 0]),
-            "bottom": Vector([0, 0, -1]),
-        }
-        sides = {
-            "front": [],
-            "back": [],
-            "left": [],
-            "right": [],
-            "top": [],
-            "bottom": []
-        }
-        for face in obj_mesh.faces:
-            found = False
-            for side, vec in vectors.items():
-                ang = degrees(face.normal.angle(vec))
-                if ang == 0:
-                    sides[side].append(face)
-                    found = True
-                    break
-            if not found:
-                sides["top"].append(face)
+def get_face_normals(obj):
+    """Get the normals of all of the faces of the object as an (N,3) array. This works in object or edit mode"""
+    if obj.mode == "EDIT":
+        # The mesh data is only synced from the edit mesh when leaving edit mode, so sync it now
+        obj.update_from_editmode()
+    return read_array(obj.data.polygons, "normal", np.float32, 3)
+
+def get_loop_faces(mesh):
+    """Get the index of the face that each loop of the mesh belongs to"""
+    # Each face owns a contiguous run of loops, in face order
+    loop_totals = read_array(mesh.polygons, "loop_total", np.int32)
+    return np.repeat(np.arange(len(mesh.polygons)), loop_totals)
+
+def select_faces(obj, face_mask):
+    """Select the faces in the mask along with their edges and vertices, and deselect everything else. The object
+    must be in object mode"""
+    mesh = obj.data
+    loop_selected = face_mask[get_loop_faces(mesh)]
+    loop_edges = read_array(mesh.loops, "edge_index", np.int32)
+    loop_verts = read_array(mesh.loops, "vertex_index", np.int32)
+
+    edge_mask = np.zeros(len(mesh.edges), dtype=bool)
+    edge_mask[loop_edges[loop_selected]] = True
+    vert_mask = np.zeros(len(mesh.vertices), dtype=bool)
+    vert_mask[loop_verts[loop_selected]] = True
+
+    mesh.polygons.foreach_set("select", face_mask)
+    mesh.edges.foreach_set("select", edge_mask)
+    mesh.vertices.foreach_set("select", vert_mask)
+
+def get_face_edge_vert_indices(working_mesh, face_indices):
+    """Get the indices of the edges and vertices used by a list of faces"""
+    wanted = np.zeros(len(working_mesh.face_normals), dtype=bool)
+    wanted[face_indices] = True
+    loop_selected = wanted[working_mesh.loop_faces]
+    return np.unique(working_mesh.loop_edges[loop_selected]), np.unique(working_mesh.loop_verts[loop_selected])
+
+def faces_from_indices(obj_mesh, indices):
+    """Get the BMFaces for a list of face indices"""
+    obj_mesh.faces.ensure_lookup_table()
+    faces = obj_mesh.faces
+    return [faces[idx] for idx in indices]
+
+def get_bottom_face_indices(obj):
+    # Find all faces that are less than 90 degrees away from a straight down vector
+    normals = get_face_normals(obj)
+    return np.flatnonzero(normals[:, 2] < 0)
+
+def side_face_mask(normals, side):
+    """Get a mask of the faces that point straight out of a side"""
+    axis, direction = SIDE_AXES[side]
+    return normals[:, axis] * direction > 1 - AXIS_TOLERANCE
+
+def get_side_face_indices(obj, sides_wanted=None):
+    """Get the faces on each side of the object. If sides_wanted is given, only those sides are returned"""
+    if sides_wanted is None:
+        sides_wanted = list(SIDE_AXES) + ["top"]
+    normals = get_face_normals(obj)
+    # Find the faces that point straight out of each side. Everything else is part of the top, so the top needs
+    # every other side to be classified
+    masks = {side: side_face_mask(normals, side) for side in SIDE_AXES if side in sides_wanted or "top" in sides_wanted}
+    sides = {side: np.flatnonzero(masks[side]) for side in SIDE_AXES if side in sides_wanted}
+    if "top" in sides_wanted:
+        sides["top"] = np.flatnonzero(~np.logical_or.reduce(list(masks.values())))
     return sides
 
-def flatten_bottom(obj):
-    with ModeSet("EDIT"):
-        bm = bmesh.from_edit_mesh(obj.data)
-
-        # Make a list of the "bottom" faces of the object
-        bottom = get_bottom_faces(bm)
+def get_side_faces(obj, obj_mesh, sides_wanted=None):
+    return {side: faces_from_indices(obj_mesh, indices)
+            for side, indices in get_side_face_indices(obj, sides_wanted).items()}
+
+def classify_face_sides(normals):
+    """Get the side ID of each face from its normal"""
+    side_ids = np.full(len(normals), SIDE_IDS["top"], dtype=np.int32)
+    for side in SIDE_AXES:
+        side_ids[side_face_mask(normals, side)] = SIDE_IDS[side]
+    return side_ids
+
+def add_side_layer(obj):
+    """Store the side ID of each face in a face attribute. The object must be in object mode"""
+    side_ids = classify_face_sides(get_face_normals(obj))
+    attr = obj.data.attributes.new(SIDE_LAYER_NAME, "INT", "FACE")
+    attr.data.foreach_set("value", side_ids)
+
+def remove_side_layer(obj):
+    """Remove the side ID face attribute. The object must be in object mode"""
+    attributes = obj.data.attributes
+    attributes.remove(attributes[SIDE_LAYER_NAME])
+
+def get_face_indices_from_side_layer(working_mesh, obj_mesh, side):
+    """Get the faces on a side using the side ID attribute, classifying any faces that were added after the
+    attribute was filled in"""
+    side_ids = working_mesh.side_ids
+    new_faces = np.flatnonzero(side_ids == 0)
+    if len(new_faces) > 0:
+        side_ids[new_faces] = classify_face_sides(working_mesh.face_normals[new_faces])
+        side_layer = obj_mesh.faces.layers.int[SIDE_LAYER_NAME]
+        for face, side_id in zip(faces_from_indices(obj_mesh, new_faces), side_ids[new_faces].tolist()):
+            face[side_layer] = side_id
+
+    return np.flatnonzero(side_ids == SIDE_IDS[side])
 
-        # Get the lowest Z val from all the bottom faces
-        min_z = None
-        for face in bottom:
-            for v in face.verts:
-                if min_z is None:
-                    min_z = v.co.z
-                    continue
-                if v.co.z < min_z:
-                    min_z = v.co.z
-
-        # Set the Z value on all the bottom faces equal to the lowest
-        for face in bottom:
-            for v in face.verts:
-                v.co = v.co[0], v.co.y, min_z
+def flatten_bottom(obj):
+    with ModeSet("OBJECT"):
+        mesh = obj.data
+
+        # Make a list of the vertices in the "bottom" faces of the object
+        bottom_faces = np.zeros(len(mesh.polygons), dtype=bool)
+        bottom_faces[get_bottom_face_indices(obj)] = True
+        loop_verts = read_array(mesh.loops, "vertex_index", np.int32)
+        bottom_verts = np.unique(loop_verts[bottom_faces[get_loop_faces(mesh)]])
+        if len(bottom_verts) == 0:
+            return
+
+        # Set the Z value on all the bottom vertices equal to the lowest
+        coords = get_vertex_coords(obj)
+        coords[bottom_verts, 2] = coords[bottom_verts, 2].min()
+        mesh.vertices.foreach_set("co", coords.ravel())
+        mesh.update()
 
 def extrude_and_flatten(obj, min_thickness):
     extrude_amount = min_thickness / METER_TO_INCH
     with ModeSet("EDIT"):
-        bpy.ops.mesh.extrude_region_move(MESH_OT_extrude_region={"use_normal_flip":False,
-                                                                 "use_dissolve_ortho_edges":False,
-                                                                 "mirror":False},
-                                         TRANSFORM_OT_translate={"value":(-0, -0, extrude_amount),
-                                                                 "orient_type":'GLOBAL',
-                                                                 "orient_matrix":((1, 0, 0), (0, 1, 0), (0, 0, 1)),
-                                                                 "orient_matrix_type":'GLOBAL',
-                                                                 "constraint_axis":(False, False, True),
-                                                                 "mirror":False,
-                                                                 "use_proportional_edit":False,
-                                                                 "proportional_edit_falloff":'SMOOTH',
-                                                                 "proportional_size":1,
-                                                                 "use_proportional_connected":False,
-                                                                 "use_proportional_projected":False,
-                                                                 "snap":False,
-                                                                 "snap_target":'CLOSEST',
-                                                                 "snap_point":(0, 0, 0),
-                                                                 "snap_align":False,
-                                                                 "snap_normal":(0, 0, 0),
-                                                                 "gpencil_strokes":False,
-                                                                 "cursor_transform":False,
-                                                                 "texture_space":False,
-                                                                 "remove_on_cancel":False,
-                                                                 "release_confirm":False,
-                                                                 "use_accurate":False,
-                                                                 "use_automerge_and_split":False})
-        bpy.ops.mesh.select_all(action='DESELECT')
+        # Extrude the selected region straight up. This is what extrude_region_move does, without the operator and
+        # undo overhead
+        bm = bmesh.from_edit_mesh(obj.data)
+        region = [elem for elems in (bm.verts, bm.edges, bm.faces) for elem in elems if elem.select]
+        extruded = bmesh.ops.extrude_face_region(bm, geom=region, use_normal_flip=False, use_dissolve_ortho_edges=False)
+        new_verts = [elem for elem in extruded["geom"] if isinstance(elem, bmesh.types.BMVert)]
+        bmesh.ops.translate(bm, vec=(0, 0, extrude_amount), verts=new_verts)
+        bmesh.update_edit_mesh(obj.data, loop_triangles=False, destructive=True)
+    with ModeSet("OBJECT"):
+        # Clear the mesh selection left by the extrude
+        select_faces(obj, np.zeros(len(obj.data.polygons), dtype=bool))
     bpy.ops.object.select_all(action='DESELECT')
 
     flatten_bottom(obj)
 
+def get_vertex_coords(obj):
+    """Get the coordinates of all of the vertices of the object as an (N,3) array. This works in object or edit mode"""
+    if obj.mode == "EDIT":
+        obj.update_from_editmode()
+    return read_array(obj.data.vertices, "co", np.float32, 3)
+
 def get_bounding_box(obj):
-    with ModeSet("EDIT"):
-        min_x = max_x = min_y = max_y = min_z = max_z = None
-        bm = bmesh.from_edit_mesh(obj.data)
-        # bottom = get_bottom_faces(bm)
-        # for face in bottom:
-        for face in bm.faces:
-            for v in face.verts:
-                if min_x is None:
-                    min_x = v.co.z
-                if max_x is None:
-                    max_x = v.co.z
-                if min_y is None:
-                    min_y = v.co.z
-                if max_y is None:
-                    max_y = v.co.z
-                if min_z is None:
-                    min_z = v.co.z
-
-                if v.co.x > max_x:
-                    max_x = v.co.x
-                if v.co.y > max_y:
-                    max_y = v.co.y
-                if v.co.x < min_x:
-                    min_x = v.co.x
-                if v.co.y < min_y:
-                    min_y = v.co.y
-                if v.co.z < min_z:
-                    min_z = v.co.z
-        # top = get_top_faces(bm)
-        # for face in top:
-        #     for v in face.verts:
-        #         if max_z is None:
-        #             max_z = v.co.z
-        #             continue
-        #         if v.co.z > max_z:
-        #             max_z = v.co.z
-        return min_x, min_y, min_z, max_x, max_y, max_z
+    coords = get_vertex_coords(obj)
+    min_x, min_y, min_z = coords.min(axis=0).tolist()
+    max_x, max_y, max_z = coords.max(axis=0).tolist()
+    return min_x, min_y, min_z, max_x, max_y, max_z
 
 def print_verts(verts):
     log = GetLogger()
+    if not log.isEnabledFor(logging.INFO):
+        return
     prefix = "Point " if len(verts) == 1 else "Points"
     for idx, v in enumerate(verts):
         log.info("    {}: ({: >27.24f},{: >27.24f},{: >27.24f})".format(prefix if idx == 0 else "      ",
@@ -229,6 +300,9 @@ def print_verts(verts):
 
 def print_selected(bm):
     log = GetLogger()
+    # Don't walk the whole mesh if nothing would be printed
+    if not log.isEnabledFor(logging.INFO):
+        return
     # selected_faces = set()
     selected_edges = set()
     selected_verts = set()
@@ -246,84 +320,101 @@ def print_selected(bm):
 
 def simplify_faces(obj):
     log = GetLogger()
-    min_x, min_y, _, max_x, max_y, _ = get_bounding_box(obj)
+
+    # Classify the faces once up front. Faces joined by a dissolve keep the side ID of the faces they replace
+    with ModeSet("OBJECT"):
+        add_side_layer(obj)
 
     with ModeSet('EDIT'):
-        bpy.ops.mesh.select_all(action='DESELECT')
         bm = bmesh.from_edit_mesh(obj.data)
+        working_mesh = WorkingMesh(obj)
         for face_name in ("left","right","front","back","bottom"):
             log.info(f"Simplifying {face_name} side faces")
-            face_limit = 25000
-            sides = get_side_faces(bm)
-            previous_face_count = None
-            while True:
-                sides = get_side_faces(bm)
-                log.info(f"  Face count = {len(sides[face_name])}")
-                if len(sides[face_name]) <= 1 or len(sides[face_name]) == previous_face_count:
-                    break
-                bpy.ops.mesh.select_all(action='DESELECT')
-                face_count = 0
-                for face in sides[face_name]:
-                    for edge in face.edges:
-                        # Select the edges where the angle of the faces is 0
-                        # This will only select an edge where the two faces are perfectly flat
-                        angle_rad = edge.calc_face_angle()
-                        if round(angle_rad, 3) == 0.0:
-                            edge.select_set(True)
-                            for v in edge.verts:
-                                v.select_set(True)
-                    face_count += 1
-                    if face_count >= face_limit or face_count >= len(sides[face_name]):
-                        previous_face_count = len(sides[face_name])
-                        bmesh.update_edit_mesh(obj.data)
-                        bpy.ops.mesh.dissolve_edges()
-                        face_count = 0
-                        break
+            side_faces = get_face_indices_from_side_layer(working_mesh, bm, face_name)
+            log.info(f"  Face count = {len(side_faces)}")
+            if len(side_faces) <= 1:
+                continue
+            # Merge all of the faces on this side that are flat with each other in a single pass
+            edge_indices, vert_indices = get_face_edge_vert_indices(working_mesh, side_faces)
+            bm.edges.ensure_lookup_table()
+            bm.verts.ensure_lookup_table()
+            bmesh.ops.dissolve_limit(bm,
+                                     angle_limit=COPLANAR_ANGLE,
+                                     use_dissolve_boundaries=False,
+                                     edges=[bm.edges[idx] for idx in edge_indices.tolist()],
+                                     verts=[bm.verts[idx] for idx in vert_indices.tolist()],
+                                     delimit={'NORMAL'})
+            bmesh.update_edit_mesh(obj.data, loop_triangles=False, destructive=True)
+            working_mesh.refresh()
+            log.info(f"  Face count = {len(get_face_indices_from_side_layer(working_mesh, bm, face_name))}")
+
+    with ModeSet("OBJECT"):
+        remove_side_layer(obj)
+
+def add_image_material(obj, name, image_path):
+    """Create a material that uses an image as its base color and add it to the object. Returns the material slot index"""
+    material = bpy.data.materials.new(name)
+    material.use_nodes = True
+    tex_img = material.node_tree.nodes.new('ShaderNodeTexImage')
+    # Loading only creates the image datablock, the pixels are decoded the first time they are used
+    tex_img.image = bpy.data.images.load(f"//{image_path}", check_existing=True)
+    bsdf = material.node_tree.nodes["Principled BSDF"]
+    material.node_tree.links.new(bsdf.inputs['Base Color'], tex_img.outputs['Color'])
+
+    # Add the material straight to the mesh instead of going through the material slot operators
+    obj.data.materials.append(material)
+    return len(obj.data.materials) - 1
+
+# Cache of the 3D view area and region for each screen, keyed by the screen pointer. The scripts never open another
+# file or change the screen layout, so these live for the whole blender process and are never cleared
+_VIEW3D_CACHE = {}
+# Cache of the operator context override for the 3D view of each screen, keyed by the screen pointer
+_VIEW3D_OVERRIDE_CACHE = {}
 
 def get_view3d_area_region(screen):
+    key = screen.as_pointer()
+    if key in _VIEW3D_CACHE:
+        return _VIEW3D_CACHE[key]
     for area in screen.areas:
         if area.type == "VIEW_3D":
             for region in area.regions:
                 if region.type == "WINDOW":
+                    _VIEW3D_CACHE[key] = (area, region)
                     return area, region
+    return None
+
+def get_view3d_override(screen):
+    """Get a context override to run operators in the 3D view of the screen"""
+    key = screen.as_pointer()
+    if key not in _VIEW3D_OVERRIDE_CACHE:
+        area, region = get_view3d_area_region(screen)
+        _VIEW3D_OVERRIDE_CACHE[key] = {
+            "window": bpy.context.window,
+            "screen": screen,
+            "area": area,
+            "region": region,
+            "scene": bpy.context.scene,
+            "space": area.spaces[0],
+        }
+    return _VIEW3D_OVERRIDE_CACHE[key]
 
 def set_top_view(screen):
-    area, region = get_view3d_area_region(screen)
-    override = bpy.context.copy()
-    override['area'] = area
-    override['region'] = region
-    bpy.ops.view3d.view_axis(override, type='TOP')
+    bpy.ops.view3d.view_axis(get_view3d_override(screen), type='TOP')
 
 def set_zoomed_view(screen):
     select_obj()
-    area, region = get_view3d_area_region(screen)
-    override = bpy.context.copy()
-    override['area'] = area
-    override['region'] = region
     # bpy.ops.view3d.select_box(override, xmin=0,xmax=area.width,ymin=0,ymax=area.height,mode='ADD')
-    bpy.ops.view3d.view_selected(override, use_all_regions=False)
+    bpy.ops.view3d.view_selected(get_view3d_override(screen), use_all_regions=False)
         # for obj in bpy.data.objects:
         #     obj.select_set(False)
 
 def set_rendered_view(screen):
-    area, region = get_view3d_area_region(screen)
-    override = bpy.context.copy()
-    override['area'] = area
-    override['region'] = region
-    bpy.ops.view3d.toggle_shading(override, type='RENDERED')
+    bpy.ops.view3d.toggle_shading(get_view3d_override(screen), type='RENDERED')
 
 def project_uv(screen):
-    area, region = get_view3d_area_region(screen)
-    space = area.spaces[0]
-
-    # override = bpy.context.copy()
-    override = {}
-    override['window'] = bpy.context.window
-    override['screen'] = screen
-    override['area'] = area
-    override['region'] = region
-    override['scene'] = bpy.context.scene
-    override['space'] = space
+    override = get_view3d_override(screen)
+    space = override["space"]
+
     # Make sure we are in orthographic view
     if space.region_3d.view_perspective != "ORTHO":
         bpy.ops.view3d.view_persportho(override)
@@ -344,12 +435,8 @@ def project_uv(screen):
                                     scale_to_bounds=True)
 
 def deselect_all(screen):
-    area, region = get_view3d_area_region(screen)
-    override = {}#bpy.context.copy()
-    override['area'] = area
-    override['region'] = region
     with ModeSet("OBJECT"):
-        bpy.ops.object.select_all(override, action='DESELECT')
+        bpy.ops.object.select_all(get_view3d_override(screen), action='DESELECT')
 
 def finish_model_in_blender(preview_file):
     log = GetLogger()
@@ -9,7 +9,6 @@ from pyapputil.typeutil import ValidateAndDefault, OptionalValueType, StrType, B
 from pyapputil.logutil import GetLogger, logargs
 from pyapputil.exceptutil import ApplicationError, InvalidArgumentError
 
-from geo import GPXFile, dem_to_model2, get_cropped_elevation_filename, get_dem_data
 from util import MetadataFile
 
 @logargs
@@ -54,9 +53,11 @@ def build_mesh(gpx_file,
     localargs = locals()
     log = GetLogger()
 
+    # Import GDAL and friends here so --help and bad arguments do not pay for loading them
+    from geo import GPXFile, dem_to_model2, get_cropped_elevation_filename, get_dem_data #pylint: disable=import-outside-toplevel
 
     # Determine the bounds of the output
-    if gpx_file and None in (min_lat, min_long, max_lat, max_long):
+    if gpx_file and (min_lat is None or min_long is None or max_lat is None or max_long is None):
         log.info("Parsing GPX file")
         gpx = GPXFile(gpx_file)
         try:
@@ -67,7 +68,7 @@ def build_mesh(gpx_file,
     if not mesh_file and gpx_file:
         mesh_file = Path(gpx_file).stem + ".stl"
 
-    if not dem_filename and None in (min_lat, min_long, max_lat, max_long):
+    if not dem_filename and (min_lat is None or min_long is None or max_lat is None or max_long is None):
         raise InvalidArgumentError("You must specify an area")
 
     metadata = MetadataFile(mesh_file)
@@ -86,7 +87,7 @@ def build_mesh(gpx_file,
         cache_dir = Path(cache_dir)
         dem_filename = Path(get_cropped_elevation_filename(max_lat, min_long, min_lat, max_long))
         input_file = cache_dir / dem_filename
-        log.debug(f"Looking for cached elevation data {input_file}")
+        log.debug("Looking for cached elevation data %s", input_file)
         if not (input_file).exists():
             try:
                 get_dem_data(dem_filename, min_lat, min_long, max_lat, max_long, cache_dir)
@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 """Run a script in Blender to finish the model"""
 
+import os
 from pathlib import Path
 import re
+import shutil
 import subprocess
 import sys
-from zipfile import ZipFile, ZIP_DEFLATED
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
 
 from pyapputil.appframework import PythonApp
 from pyapputil.argutil import ArgumentParser
@@ -14,6 +16,9 @@ from pyapputil.logutil import GetLogger, logargs
 
 from util import MetadataFile
 
+# Lines that start with a date are log output from our own script inside blender
+SCRIPT_LOG_LINE = re.compile(rb"^\d{4}-\d{2}-\d{2}")
+
 @logargs
 @ValidateAndDefault({
     # "arg_name" : (arg_type, arg_default)
@@ -60,42 +65,39 @@ def create_model(mesh_file,
 
     blender_path = "/opt/blender/blender"
     parts = [
-        f"PYTHONPATH={cwd}",
         blender_path,
         "-noaudio",
         "--python-use-system-env",
         "--python",
         "internal_create_model.py",
     ]
-    if any([mesh_file, output_file, min_thickness, size, map_image, background_image, preview_file, collada_file]):
-        parts += ["--"]
-    if mesh_file:
-        parts += ["--mesh-file", str(mesh_file)]
-    if output_file:
-        parts += ["--output-file", str(output_file)]
-    if min_thickness:
-        parts += ["--min-thickness", str(min_thickness)]
-    if size:
-        parts += ["--size", str(size)]
-    if map_image:
-        parts += ["--map-image", str(map_image)]
-    if background_image:
-        parts += ["--background-image", str(background_image)]
-    if preview_file:
-        parts += ["--preview-file", str(preview_file)]
-    if collada_file:
-        parts += ["--collada-file", str(collada_file)]
+    # Arguments for the script running inside blender
+    script_args = (
+        ("--mesh-file", mesh_file),
+        ("--output-file", output_file),
+        ("--min-thickness", min_thickness),
+        ("--size", size),
+        ("--map-image", map_image),
+        ("--background-image", background_image),
+        ("--preview-file", preview_file),
+        ("--collada-file", collada_file),
+    )
+    parts += ["--"]
+    for arg_name, arg_value in script_args:
+        if arg_value is not None:
+            parts += [arg_name, str(arg_value)]
     # parts += ["-d", "-d"]
 
-    cmd = " ".join(parts)
     log.info("Invoking blender...")
 
-    with subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT) as process:
+    # Run blender directly instead of through a shell, so paths don't need quoting
+    env = dict(os.environ, PYTHONPATH=str(cwd))
+    with subprocess.Popen(parts, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT) as process:
         # Stream the output from blender and the script to the screen
         for line in iter(process.stdout.readline, b''):
             line = line.strip()
             # Detect formatted output from the script and write stdout vs output from blender and send to log
-            if re.search(rb"^\d{4}-\d{2}-\d{2}", line):
+            if SCRIPT_LOG_LINE.match(line):
                 sys.stdout.write(line.decode(sys.stdout.encoding) + "\n")
             else:
                 log.info(f"  blender: {line.decode('utf-8')}")
@@ -107,10 +109,12 @@ def create_model(mesh_file,
         return False
 
     log.info("Creating archive")
-    with ZipFile(zip_file, "w", compression=ZIP_DEFLATED) as archive:
-        archive.write(str(collada_file), collada_file.name)
-        archive.write(str(background_image), background_image.name)
-        archive.write(str(map_image), map_image.name)
+    # The collada file is text that deflates well even at the fastest level
+    with ZipFile(zip_file, "w", compression=ZIP_DEFLATED, compresslevel=1) as archive:
+        add_to_archive(archive, collada_file)
+        # The images are already compressed, so deflating them again only costs time
+        add_to_archive(archive, background_image, stored=True)
+        add_to_archive(archive, map_image, stored=True)
     log.info(f"Created archive {zip_file}")
 
     collada_file.unlink()
@@ -121,6 +125,18 @@ def create_model(mesh_file,
     log.passed("Successfully created model")
     return True
 
+def add_to_archive(archive, filename, stored=False):
+    """Add a file to the top level of a zip archive, copying it in large chunks. Stored files are not compressed,
+    anything else uses the compression and level of the archive"""
+    if stored:
+        entry = ZipInfo.from_file(filename, filename.name)
+        entry.compress_type = ZIP_STORED
+    else:
+        # Opening by name is the only way for the entry to pick up the compression level of the archive
+        entry = filename.name
+    with open(filename, "rb") as src, archive.open(entry, "w") as dest:
+        shutil.copyfileobj(src, dest, 1024 * 1024)
+
 
 if __name__ == '__main__':
     parser = ArgumentParser(description="Import x3d/stl mesh and build a nice model")
@@ -9,8 +9,6 @@ from pyapputil.typeutil import ValidateAndDefault, OptionalValueType, StrType, B
 from pyapputil.logutil import GetLogger, logargs
 from pyapputil.exceptutil import InvalidArgumentError, ApplicationError
 
-from geo import GPXFile, get_image_data, get_cropped_image_filename
-
 @logargs
 @ValidateAndDefault({
     # "arg_name" : (arg_type, arg_default)
@@ -45,6 +43,9 @@ def download_image_data(gpx_file,
     """
     log = GetLogger()
 
+    # Import GDAL and friends here so --help and bad arguments do not pay for loading them
+    from geo import GPXFile, get_image_data, get_cropped_image_filename #pylint: disable=import-outside-toplevel
+
     # Determine the bounds of the output
     if gpx_file:
         log.info("Parsing GPX file")
@@ -55,7 +56,7 @@ def download_image_data(gpx_file,
             log.error(ex)
             return False
 
-    if None in (min_lat, min_long, max_lat, max_long):
+    if min_lat is None or min_long is None or max_lat is None or max_long is None:
         raise InvalidArgumentError("You must specify an area to download")
 
     log.info(f"Requested boundaries top(max_lat)={max_lat} left(min_long)={min_long} bottom(min_lat)={min_lat} right(max_long)={max_long}")
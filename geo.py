@@ -1,5 +1,7 @@
 """Helpers for processing GIS data into 3D models"""
 import bisect
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import math
 import os
 from pathlib import Path
@@ -11,6 +13,7 @@ import zipfile
 from affine import Affine
 from dateutil.parser import isoparse
 from lxml import etree as ET
+import numpy as np
 from osgeo import gdal, osr
 from pyapputil.logutil import GetLogger
 from pyapputil.exceptutil import ApplicationError
@@ -18,9 +21,12 @@ from pyapputil.shellutil import Shell
 import requests
 
 from gtm2.generate_terrain import generate_terrain as gtm2_generate_terrain
-from util import download_file, list_like
+from util import HTTP_POOL_SIZE, HTTP_SESSION, download_file, list_like, prefetch_file
 
 
+# Number of tiles to download at the same time, one per pooled connection
+DOWNLOAD_THREADS = HTTP_POOL_SIZE
+
 # Make GDAL throw exceptions for Failure/Fatal messages
 gdal.UseExceptions()
 
@@ -134,6 +140,8 @@ class GPXFile:
             filename:   (str) The name of the GPX file.
         """
         self.filename = filename
+        self._points = None
+        self._track_ends = None
 
     def GetBounds(self, padding=0, square=False):
         """
@@ -151,23 +159,11 @@ class GPXFile:
             max_lat, max_long.
         """
         log = GetLogger()
-        root = self._parse()
-        max_lat = -90.0
-        min_lat = 90.0
-        max_long = -180.0
-        min_long = 180.0
-        for node in root.findall("trk/trkseg/trkpt", root.nsmap):
-            node_lat = float(node.attrib["lat"])
-            node_long = float(node.attrib["lon"])
-
-            if node_lat > max_lat:
-                max_lat = node_lat
-            if node_lat < min_lat:
-                min_lat = node_lat
-            if node_long > max_long:
-                max_long = node_long
-            if node_long < min_long:
-                min_long = node_long
+        coords, _ = self._read_points()
+        if len(coords) == 0:
+            raise ApplicationError(f"Could not find any track points in {self.filename}")
+        min_lat, min_long = coords.min(axis=0).tolist()
+        max_lat, max_long = coords.max(axis=0).tolist()
         center_lat, center_long = ( (max_lat + min_lat)/2, (max_long + min_long)/2 )
         log.debug2(f"GPX tracks min_lat={min_lat}, min_long={min_long}, max_lat={max_lat}, max_long={max_long}, center_lat={center_lat}, center_long={center_long}")
 
@@ -183,10 +179,12 @@ class GPXFile:
             log.debug2(f"Squared min_lat={min_lat}, min_long={min_long}, max_lat={max_lat}, max_long={max_long}")
 
         if padding != 0:
-            min_lat = round(min_lat - padding / degree_lat_to_miles(center_lat), 7)
-            min_long = round(min_long - padding / degree_long_to_miles(center_lat), 7)
-            max_lat = round(max_lat + padding / degree_lat_to_miles(center_lat), 7)
-            max_long = round(max_long + padding / degree_long_to_miles(center_lat), 7)
+            lat_padding = padding / degree_lat_to_miles(center_lat)
+            long_padding = padding / degree_long_to_miles(center_lat)
+            min_lat = round(min_lat - lat_padding, 7)
+            min_long = round(min_long - long_padding, 7)
+            max_lat = round(max_lat + lat_padding, 7)
+            max_long = round(max_long + long_padding, 7)
             log.debug2(f"Padded min_lat={min_lat}, min_long={min_long}, max_lat={max_lat}, max_long={max_long}")
 
         return (min_lat, min_long, max_lat, max_long)
@@ -206,19 +204,13 @@ class GPXFile:
         Get all of the points in all of the tracks.
 
         Returns:
-            (list of list of tuple of float) A list of tracks where each track
-            is a list of tuples of float as lat,long.
+            (list of numpy.ndarray) A list of tracks where each track is an
+            (N,2) array of float as lat,long.
         """
-        tracks = []
-        root = self._parse()
-        for track_node in root.findall("trk", root.nsmap):
-            track = []
-            for node in track_node.findall("trkseg/trkpt", root.nsmap):
-                node_lat = float(node.attrib["lat"])
-                node_long = float(node.attrib["lon"])
-                track.append((node_lat, node_long))
-            tracks.append(track)
-        return tracks
+        points, track_ends = self._read_points()
+        if not track_ends:
+            return []
+        return np.split(points, track_ends[:-1])
 
     def ToCSV(self, csvfile):
         """
@@ -227,25 +219,36 @@ class GPXFile:
         Args:
             csvfile:    (string) The file path to save the tracks to.
         """
-        root = self._parse()
-        with open(csvfile, "w", encoding="utf-8") as outfile:
-            outfile.write("LON,LAT\n")
-            for node in root.findall("trk/trkseg/trkpt", root.nsmap):
-                node_lat = float(node.attrib["lat"])
-                node_long = float(node.attrib["lon"])
-                outfile.write(f"{node_long},{node_lat}\n")
-
-    def _parse(self):
+        points, _ = self._read_points()
+        np.savetxt(csvfile, points[:, ::-1], fmt="%s", delimiter=",", header="LON,LAT", comments="", encoding="utf-8")
+
+    def _read_points(self):
+        """Read the lat,long of every track point into an (N,2) array, along with the index just past the last point
+        of each track. The file is only read the first time"""
+        if self._points is not None:
+            return self._points, self._track_ends
+
         if not Path(self.filename).exists():
             raise ApplicationError(f"Could not find file {self.filename}")
+        coords = []
+        track_ends = []
         try:
-            tree = ET.parse(self.filename)
-            return tree.getroot()
+            # Stream through the file instead of building the whole tree, and drop each node once it has been read
+            for _, node in ET.iterparse(self.filename, tag=("{*}trk", "{*}trkpt")):
+                if node.tag.endswith("trkpt"):
+                    coords.append((node.attrib["lat"], node.attrib["lon"]))
+                else:
+                    track_ends.append(len(coords))
+                node.clear()
         except OSError as ex:
             raise ApplicationError(str(ex)) from ex
         except ET.ParseError as ex:
             raise ApplicationError(f"Error parsing {self.filename}: {ex}") from ex
 
+        self._points = np.array(coords, dtype=np.float64).reshape(-1, 2)
+        self._track_ends = track_ends
+        return self._points, self._track_ends
+
 def degree_long_to_miles(lat):
     """
     Calculate the length of 1 degree of longitude in miles at a given latitude.
@@ -297,7 +300,7 @@ def raster_stats(data_source):
     gx_size = plus1_long - orig_long
     gy_size = plus1_lat - orig_lat
     long_feet = degree_long_to_miles(orig_lat) * 5280
-    lat_feet = degree_long_to_miles(orig_lat) * 5280
+    lat_feet = degree_lat_to_miles(orig_lat) * 5280
     px_size = long_feet * (plus1_long - orig_long)
     py_size = lat_feet * (plus1_lat - orig_lat)
     log.info(f"  Origin(UL) = {orig_long, orig_lat}")
@@ -341,37 +344,23 @@ def align_image_elevation(min_lat, min_long, max_lat, max_long, cache_dir=Path("
 
     # Make a list of image tiles we need to cover this region and download them
     tile_coords = get_image_tile_range(min_lat, min_long, max_lat, max_long)
-    image_files = []
-    for lat, long in tile_coords:
-        try:
-            tile_file = download_image_tile(lat, long, cache_dir)
-        except (requests.HTTPError, requests.ConnectionError, requests.Timeout) as ex:
-            raise ApplicationError(f"Error downloading image: {ex}.\nTry checking your internet connection, or check https://www.sciencebase.gov/catalog/status and https://apps.nationalmap.gov/services-checker/#/uptime") from ex
-        image_files.append(tile_file)
+    try:
+        image_files = download_tiles(download_image_tile, tile_coords, cache_dir)
+    except (requests.HTTPError, requests.ConnectionError, requests.Timeout) as ex:
+        raise ApplicationError(f"Error downloading image: {ex}.\nTry checking your internet connection, or check https://www.sciencebase.gov/catalog/status and https://apps.nationalmap.gov/services-checker/#/uptime") from ex
     # Create a virtual data source with all of the tiles
-    file_list = " ".join(str(f) for f in image_files)
-    log.debug(f"Creating virtual data set with tiles [{file_list}]")
-    _, image_input_file = tempfile.mkstemp()
-    retcode, _, stderr = Shell(f"gdalbuildvrt {image_input_file} {file_list}")
-    if retcode != 0 or "ERROR" in stderr:
-        raise ApplicationError(f"Could not merge input files: {stderr}")
+    log.debug("Creating virtual data set with tiles %s", image_files)
+    image_input_file = create_virtual_dataset(image_files)
 
     # Make a list of elevation tiles we need to cover this region and download them
     tile_coords = get_elevation_tile_range(min_lat, min_long, max_lat, max_long)
-    elevation_files = []
-    for lat, long in tile_coords:
-        try:
-            tile_file = download_elevation_tile(lat, long, cache_dir)
-        except (requests.HTTPError, requests.ConnectionError, requests.Timeout) as ex:
-            raise ApplicationError(f"Error downloading elevation file: {ex}.\nTry checking your internet connection, or check https://www.sciencebase.gov/catalog/status and https://apps.nationalmap.gov/services-checker/#/uptime") from ex
-        elevation_files.append(tile_file)
+    try:
+        elevation_files = download_tiles(download_elevation_tile, tile_coords, cache_dir)
+    except (requests.HTTPError, requests.ConnectionError, requests.Timeout) as ex:
+        raise ApplicationError(f"Error downloading elevation file: {ex}.\nTry checking your internet connection, or check https://www.sciencebase.gov/catalog/status and https://apps.nationalmap.gov/services-checker/#/uptime") from ex
     # Create a virtual data source with all of the tiles
-    file_list = " ".join(str(f) for f in elevation_files)
-    log.debug(f"Creating virtual data set with tiles [{file_list}]")
-    _, elevation_input_file = tempfile.mkstemp()
-    retcode, _, stderr = Shell(f"gdalbuildvrt {elevation_input_file} {file_list}")
-    if retcode != 0 or "ERROR" in stderr:
-        raise ApplicationError(f"Could not merge input files: {stderr}")
+    log.debug("Creating virtual data set with tiles %s", elevation_files)
+    elevation_input_file = create_virtual_dataset(elevation_files)
 
     wgs84 = osr.SpatialReference()
     wgs84.SetFromUserInput('WGS84')
@@ -516,7 +505,7 @@ def get_raster_dimensions(data_source):
 
     return data
 
-def convert_and_crop_raster(input_filename, output_filename, min_lat, min_long, max_lat, max_long, output_type="GTiff", remove_alpha=False):
+def convert_and_crop_raster(input_filename, output_filename, min_lat, min_long, max_lat, max_long, output_type="GTiff", remove_alpha=False, compress=False):
     """
     Convert a georeferenced raster file to another format and crop it to the given GPS coordinates
 
@@ -529,14 +518,10 @@ def convert_and_crop_raster(input_filename, output_filename, min_lat, min_long,
         max_long:           the east edge of the new file, in decimal degrees (float)
         output_type:        the data format of the new file (string)
         remove_alpha:       remove the transparency from the new file, only for images (bool)
+        compress:           use fast DEFLATE compression for the new file, only for GTiff (bool)
     """
     log = GetLogger()
 
-    center_lat =  (max_lat + min_lat)/2
-    real_width = (max_long - min_long) * degree_long_to_miles(center_lat)
-    real_height = (max_lat - min_lat) * degree_lat_to_miles(center_lat)
-    log.debug(f"Cropping to {real_width}mi wide by {real_height}mi high")
-
     # Transform from GPS coords to pixel
     wgs84 = osr.SpatialReference()
     wgs84.SetFromUserInput('WGS84')
@@ -552,6 +537,8 @@ def convert_and_crop_raster(input_filename, output_filename, min_lat, min_long,
     gt = src_ds.GetGeoTransform()
     fwd_trans = Affine.from_gdal(*gt)
     rev_trans = ~fwd_trans
+    # Horizontal differencing only works on integer data, floating point data needs the floating point predictor
+    predictor = 3 if gdal.DataTypeIsFloating(src_ds.GetRasterBand(1).DataType) else 2
 
     uli_x, uli_y, _ = gps_to_image.TransformPoint(min_long, max_lat)
     ulp_x, ulp_y = rev_trans * (uli_x, uli_y)
@@ -563,18 +550,18 @@ def convert_and_crop_raster(input_filename, output_filename, min_lat, min_long,
 
     src_data = get_raster_dimensions(src_ds)
     log.debug("Input file")
-    log.debug(f"  raster = {src_data['pixel']['max_x'], src_data['pixel']['max_y']}")
-    log.debug(f"  ULg = {src_data['geo']['min_x'], src_data['geo']['max_y']}")
-    log.debug(f"  ULi = {src_data['image']['min_x'], src_data['image']['max_y']}")
-    log.debug(f"  ULp = {src_data['pixel']['min_x'], src_data['pixel']['min_y']}")
-    log.debug(f"  LRg = {src_data['geo']['max_x'], src_data['geo']['min_y']}")
-    log.debug(f"  LRi = {src_data['image']['max_x'], src_data['image']['min_y']}")
-    log.debug(f"  LRp = {src_data['pixel']['max_x'], src_data['pixel']['max_y']}")
+    log.debug("  raster = %s", (src_data['pixel']['max_x'], src_data['pixel']['max_y']))
+    log.debug("  ULg = %s", (src_data['geo']['min_x'], src_data['geo']['max_y']))
+    log.debug("  ULi = %s", (src_data['image']['min_x'], src_data['image']['max_y']))
+    log.debug("  ULp = %s", (src_data['pixel']['min_x'], src_data['pixel']['min_y']))
+    log.debug("  LRg = %s", (src_data['geo']['max_x'], src_data['geo']['min_y']))
+    log.debug("  LRi = %s", (src_data['image']['max_x'], src_data['image']['min_y']))
+    log.debug("  LRp = %s", (src_data['pixel']['max_x'], src_data['pixel']['max_y']))
 
     center_lat =  (max_lat + min_lat)/2
     real_width = (max_long - min_long) * degree_long_to_miles(center_lat)
     real_height = (max_lat - min_lat) * degree_lat_to_miles(center_lat)
-    log.debug(f"Cropping to {real_width}mi wide by {real_height}mi high")
+    log.debug("Cropping to %smi wide by %smi high", real_width, real_height)
 
     # Close the file
     src_ds = None
@@ -590,10 +577,13 @@ def convert_and_crop_raster(input_filename, output_filename, min_lat, min_long,
     # Use shell commands until I have time to debug/fix the native code
     log.info(f"Cropping to boundaries top(max_lat)={max_lat} left(min_long)={min_long} bottom(min_lat)={min_lat} right(max_long)={max_long}")
     log.info(f"Converting to {output_type}")
-    log.debug(f"Adjusted to pixel crop boundaries top={ulp_y} left={ulp_x} bottom={lrp_y} right={lrp_x}")
+    log.debug("Adjusted to pixel crop boundaries top=%s left=%s bottom=%s right=%s", ulp_y, ulp_x, lrp_y, lrp_x)
     band_args = "-b 1 -b 2 -b 3" if remove_alpha else ""
+    # The fastest deflate level gets most of the size reduction for a fraction of the CPU of the default level
+    create_args = f"-co COMPRESS=DEFLATE -co ZLEVEL=1 -co PREDICTOR={predictor}" if compress and output_type == "GTiff" else ""
     # retcode, _, stderr = Shell(f"gdal_translate -of {output_type} {band_args} -projwin_srs EPSG:4326 -projwin {min_long} {max_lat} {max_long} {min_lat} {input_filename} {output_filename}")
-    retcode, _, stderr = Shell(f"gdal_translate -of {output_type} {band_args} -srcwin {ulp_x} {ulp_y} {lrp_x - ulp_x} {lrp_y - ulp_y} {input_filename} {output_filename}")
+    # Let GDAL use every core to decode the JPEG2000 tiles and compress the output
+    retcode, _, stderr = Shell(f"gdal_translate --config GDAL_NUM_THREADS ALL_CPUS -of {output_type} {band_args} {create_args} -srcwin {ulp_x} {ulp_y} {lrp_x - ulp_x} {lrp_y - ulp_y} {input_filename} {output_filename}")
     if retcode != 0 or "ERROR" in stderr:
         raise ApplicationError(f"Could not crop file: {stderr}")
 
@@ -604,13 +594,13 @@ def convert_and_crop_raster(input_filename, output_filename, min_lat, min_long,
 
     out_data = get_raster_dimensions(out_ds)
     log.debug("Output file")
-    log.debug(f"  raster = {out_data['pixel']['max_x'], out_data['pixel']['max_y']}")
-    log.debug(f"  ULg = {out_data['geo']['min_x'], out_data['geo']['max_y']}")
-    log.debug(f"  ULi = {out_data['image']['min_x'], out_data['image']['max_y']}")
-    log.debug(f"  ULp = {out_data['pixel']['min_x'], out_data['pixel']['min_y']}")
-    log.debug(f"  LRg = {out_data['geo']['max_x'], out_data['geo']['min_y']}")
-    log.debug(f"  LRi = {out_data['image']['max_x'], out_data['image']['min_y']}")
-    log.debug(f"  LRp = {out_data['pixel']['max_x'], out_data['pixel']['max_y']}")
+    log.debug("  raster = %s", (out_data['pixel']['max_x'], out_data['pixel']['max_y']))
+    log.debug("  ULg = %s", (out_data['geo']['min_x'], out_data['geo']['max_y']))
+    log.debug("  ULi = %s", (out_data['image']['min_x'], out_data['image']['max_y']))
+    log.debug("  ULp = %s", (out_data['pixel']['min_x'], out_data['pixel']['min_y']))
+    log.debug("  LRg = %s", (out_data['geo']['max_x'], out_data['geo']['min_y']))
+    log.debug("  LRi = %s", (out_data['image']['max_x'], out_data['image']['min_y']))
+    log.debug("  LRp = %s", (out_data['pixel']['max_x'], out_data['pixel']['max_y']))
 
 def dem_to_model2(dem_filename, model_filename, z_exaggeration=1.0):
     """
@@ -627,12 +617,12 @@ def dem_to_model2(dem_filename, model_filename, z_exaggeration=1.0):
     if Path(model_filename).suffix != ".stl":
         model_filename += ".stl"
 
-    # Use geotrimesh.generate_terrain to create an scad file from the elevation data
-    scad_command_lines = gtm2_generate_terrain(dem_filename, z_scale=z_exaggeration, clippoly_filepath=None)
-    scad_command_lines = [str.encode(l) for l in scad_command_lines]
+    # Get the elevation data into the page cache while the mesh generator starts up
+    prefetch_file(dem_filename)
 
-    with tempfile.NamedTemporaryFile(delete=False) as scad_file:
-        scad_file.writelines(scad_command_lines)
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".scad", delete=False) as scad_file:
+        # Use geotrimesh.generate_terrain to create an scad file from the elevation data
+        gtm2_generate_terrain(dem_filename, scad_file, z_scale=z_exaggeration, clippoly_filepath=None)
         scad_file.close()
 
         # Use openscad to convert the scad file to an STL file
@@ -649,11 +639,14 @@ def create_virtual_dataset(file_list):
     if list_like(file_list):
         if len(file_list) > 1:
             log.info("Merging input files into virtual data set")
-            _, virtual_file = tempfile.mkstemp()
-            # The python interface to this is horrifying, so use the command line app
-            retcode, _, stderr = Shell("gdalbuildvrt {} {}".format(virtual_file, " ".join(file_list)))
-            if retcode != 0 or "ERROR" in stderr:
-                raise ApplicationError(f"Could not merge input files: {stderr}")
+            # Only the name is needed, so close the descriptor mkstemp opens rather than leaking it
+            fd, virtual_file = tempfile.mkstemp(suffix=".vrt")
+            os.close(fd)
+            # Build the VRT in process instead of running gdalbuildvrt, which also avoids any limit on the command length
+            vrt_ds = gdal.BuildVRT(virtual_file, [str(filename) for filename in file_list])
+            GDAL_ERROR.check("Could not merge input files", vrt_ds)
+            # The VRT is written out when the dataset is closed
+            vrt_ds = None
         else:
             log.debug(f"No virtual dataset to create; directly using {file_list[0]}")
             virtual_file = file_list[0]
@@ -670,7 +663,8 @@ def rotate_raster(raster_filename, output_filename, rotation_degrees):
     GDAL_ERROR.check("Error parsing input file", src_ds)
 
     # Make a copy of the original
-    _, intermediate_file = tempfile.mkstemp()
+    fd, intermediate_file = tempfile.mkstemp()
+    os.close(fd)
     log.debug(f"Using intermediate tempfile {intermediate_file}")
     driver = gdal.GetDriverByName("GTiff")
     dst_ds = driver.CreateCopy(intermediate_file, src_ds, strict=0)
@@ -739,20 +733,47 @@ def get_raster_boundaries_gps(data_source):
     max_long, min_lat, _ = trans.TransformPoint(source_extent[2], source_extent[1], 0.0)
     return (min_lat, min_long, max_lat, max_long)
 
+def clamp_bounds(bounds, limit_bounds):
+    """
+    Shrink a bounding box so that it fits inside another one.
+
+    Args:
+        bounds:         (tuple of float) The bounding box to clamp, as min_lat,
+                                         min_long, max_lat, max_long.
+        limit_bounds:   (tuple of float) The bounding box to fit inside, in the
+                                         same order.
+
+    Returns:
+        (tuple of float) The clamped bounding box as min_lat, min_long,
+        max_lat, max_long.
+    """
+    min_lat, min_long, max_lat, max_long = bounds
+    limit_min_lat, limit_min_long, limit_max_lat, limit_max_long = limit_bounds
+    return (max(min_lat, limit_min_lat), max(min_long, limit_min_long),
+            min(max_lat, limit_max_lat), min(max_long, limit_max_long))
+
+def get_elevation_tile_corner(latitude, longitude):
+    """Get the upper left corner of the 1 degree elevation tile covering the given coordinates, as integers"""
+    return math.ceil(latitude), math.floor(longitude)
+
+def get_elevation_tile_id(upper, left):
+    """Get the ID of the elevation tile with the given integer upper left corner, in the same form as get_coords_string"""
+    return f"{'n' if upper > 0 else 's'}{abs(upper)}{'e' if left > 0 else 'w'}{abs(left)}"
+
 def get_elevation_tilename(latitude, longitude):
     """Get the filename for a tile covering the given coordinates"""
-    upper = int(math.ceil(latitude))
-    left = int(math.floor(longitude))
-    return f"dem-{get_coords_string(upper, left)}.tif"
+    return f"dem-{get_elevation_tile_id(*get_elevation_tile_corner(latitude, longitude))}.tif"
 
 def get_image_tile_name(latitude, longitude):
     """Get the filename for an image tile covering the given coordinates"""
     return f"image-{get_coords_string(latitude, longitude)}.jp2"
 
+@lru_cache(maxsize=256)
 def get_cropped_elevation_filename(max_lat, min_long, min_lat, max_long):
     """Get the filename for a cropped elevation file for a given area"""
     return f"cropped-dem-{get_coords_string(max_lat, min_long)}_{get_coords_string(min_lat, max_long)}.tif"
 
+@lru_cache(maxsize=256)
 def get_cropped_image_filename(max_lat, min_long, min_lat, max_long):
     """Get the filename for a cropped image file for a given area"""
     return f"cropped-image-{get_coords_string(max_lat, min_long)}_{get_coords_string(min_lat, max_long)}.tif"
@@ -781,14 +802,14 @@ def download_elevation_tile(latitude, longitude, dest_dir):
     """
     log = GetLogger()
 
-    upper = int(math.ceil(latitude))
-    left = int(math.floor(longitude))
+    upper, left = get_elevation_tile_corner(latitude, longitude)
+    tile_id = get_elevation_tile_id(upper, left)
 
     dest_dir = Path(dest_dir)
     dest_dir.mkdir(parents=True, exist_ok=True)
 
     # Check the local cache to see if we already have this tile
-    output_file = dest_dir / Path(get_elevation_tilename(latitude, longitude))
+    output_file = dest_dir / get_elevation_tilename(latitude, longitude)
     log.debug(f"Checking cache for {output_file}")
     if output_file.exists():
         log.info(f"Using cached elevation data for ({upper},{left})")
@@ -802,7 +823,7 @@ def download_elevation_tile(latitude, longitude, dest_dir):
         "datasets": "National Elevation Dataset (NED) 1/3 arc-second",
         "max": 10
     }
-    with requests.get(query_url, params=payload) as r:
+    with HTTP_SESSION.get(query_url, params=payload, timeout=(10, 120)) as r:
         log.debug(r.url)
         r.raise_for_status()
         resp = r.json()
@@ -814,33 +835,37 @@ def download_elevation_tile(latitude, longitude, dest_dir):
         raise ApplicationError("Could not find an elevation product for the requested area from the National Map")
     url = items[0]["downloadURL"]
 
-    # Download the file we got from the API
+    # Download the file we got from the API. The download is deleted along with the temporary directory once it has
+    # been converted, which also drops it from the page cache, so it needs no POSIX_FADV_DONTNEED hint
     with tempfile.TemporaryDirectory() as download_dir:
         pieces = urlparse(url)
         base_filename = Path(pieces.path).name
         local_filename = Path(download_dir) / base_filename
         download_file(url, local_filename)
 
-        # Extract if necessary
+        # Find the elevation data inside the zip if necessary
         if local_filename.suffix == ".zip":
-            log.info("Extracting elevation data file")
-            log.debug(f"Extracting {local_filename} to {download_dir}")
+            known_filenames = [f"grd{tile_id}_13", f"USGS_NED_13_{tile_id}_IMG.img", f"img{tile_id}_13.img"]
             with zipfile.ZipFile(local_filename) as archive:
-                archive.extractall(path=download_dir)
-            # Find the data file in the zip
-            coords = get_coords_string(upper, left)
-            known_filenames = [f"grd{coords}_13", f"USGS_NED_13_{coords}_IMG.img", f"img{coords}_13.img"]
+                top_level_names = {name.split("/")[0] for name in archive.namelist()}
+            # Find the data file in the zip. GDAL can read it straight out of the zip, so it does not need to be extracted
+            data_filename = None
             for fname in known_filenames:
-                if (download_dir / fname).exists():
-                    data_filename = download_dir / fname
+                if fname in top_level_names:
+                    data_filename = f"/vsizip/{local_filename}/{fname}"
                     break
+            if not data_filename:
+                raise ApplicationError(f"Could not find elevation data in {base_filename}")
+            log.debug(f"Reading elevation data from {data_filename}")
         else:
             data_filename = local_filename
 
-        # Convert to GeoTIFF
-        retcode, _, stderr = Shell(f"gdal_translate -of GTiff {data_filename} {output_file}")
+        # Convert to GeoTIFF, then move it into the cache so a failed conversion never leaves a partial tile behind
+        converted_file = Path(download_dir) / output_file.name
+        retcode, _, stderr = Shell(f"gdal_translate -of GTiff {data_filename} {converted_file}")
         if retcode != 0 or "ERROR" in stderr:
             raise ApplicationError(f"Could not convert tile: {stderr}")
+        shutil.move(converted_file, output_file)
 
         log.info(f"Added elevation data to cache for ({upper},{left})")
 
@@ -881,7 +906,7 @@ def download_image_tile(latitude, longitude, dest_dir):
         "datasets": "USDA National Agriculture Imagery Program (NAIP)",
         "max": 100
     }
-    with requests.get(query_url, params=payload) as r:
+    with HTTP_SESSION.get(query_url, params=payload, timeout=(10, 120)) as r:
         log.debug(r.url)
         r.raise_for_status()
         resp = r.json()
@@ -1027,6 +1052,23 @@ def get_tile_coords_range(min_lat, min_long, max_lat, max_long, interval):
             tiles.append((lat, long))
     return tiles
 
+def download_tiles(download_tile, tile_coords, dest_dir):
+    """
+    Download a list of tiles in parallel.
+
+    Args:
+        download_tile:  (function)          The function to download a single tile, called with lat, long, dest_dir.
+        tile_coords:    (list of tuple)     The lat,long coordinates of each tile.
+        dest_dir:       (Path)              The directory to download the tiles to.
+
+    Returns:
+        (list of Path) The full path of each tile file, in the same order as tile_coords.
+    """
+    # The downloads are network bound, so threads let the tiles come down in parallel
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_THREADS) as executor:
+        futures = [executor.submit(download_tile, lat, long, dest_dir) for lat, long in tile_coords]
+        return [future.result() for future in futures]
+
 def get_dem_data(dem_filename, min_lat, min_long, max_lat, max_long, cache_dir=Path("cache")):
     """
     Get the elevation data for the given region. This will download, crop and
@@ -1042,32 +1084,26 @@ def get_dem_data(dem_filename, min_lat, min_long, max_lat, max_long, cache_dir=P
     """
     log = GetLogger()
 
-    log.debug(f"Checking cache for {cache_dir / dem_filename}")
-    if (cache_dir / dem_filename).exists():
+    output_file = cache_dir / dem_filename
+    log.debug(f"Checking cache for {output_file}")
+    if output_file.exists():
         log.info(f"Using cached elevation data file {dem_filename}")
         return
 
     # Make a list of elevation tiles we need to cover this region and download them
     tile_coords = get_elevation_tile_range(min_lat, min_long, max_lat, max_long)
-    elevation_files = []
-    for lat, long in tile_coords:
-        try:
-            tile_file = download_elevation_tile(lat, long, cache_dir)
-        except (requests.HTTPError, requests.ConnectionError, requests.Timeout) as ex:
-            raise ApplicationError(f"Error downloading image: {ex}.\nTry checking your internet connection, or check https://www.sciencebase.gov/catalog/status and https://apps.nationalmap.gov/services-checker/#/uptime") from ex
-        elevation_files.append(tile_file)
+    try:
+        elevation_files = download_tiles(download_elevation_tile, tile_coords, cache_dir)
+    except (requests.HTTPError, requests.ConnectionError, requests.Timeout) as ex:
+        raise ApplicationError(f"Error downloading elevation data: {ex}.\nTry checking your internet connection, or check https://www.sciencebase.gov/catalog/status and https://apps.nationalmap.gov/services-checker/#/uptime") from ex
 
     # Create a virtual data source with all of the tiles
-    file_list = " ".join(str(f) for f in elevation_files)
-    log.debug(f"Creating virtual data set with tiles [{file_list}]")
-    _, crop_input_file = tempfile.mkstemp()
-    retcode, _, stderr = Shell(f"gdalbuildvrt {crop_input_file} {file_list}")
-    if retcode != 0 or "ERROR" in stderr:
-        raise ApplicationError(f"Could not merge input files: {stderr}")
+    log.debug("Creating virtual data set with tiles %s", elevation_files)
+    crop_input_file = create_virtual_dataset(elevation_files)
 
     # Crop to the requested region and convert to geotiff
     log.info("Converting and cropping elevation data")
-    convert_and_crop_raster(crop_input_file, cache_dir / dem_filename, min_lat, min_long, max_lat, max_long, remove_alpha=False)
+    convert_and_crop_raster(crop_input_file, output_file, min_lat, min_long, max_lat, max_long, remove_alpha=False, compress=True)
 
 def get_image_data(image_filename, min_lat, min_long, max_lat, max_long, cache_dir=Path("cache")):
     """
@@ -1084,28 +1120,22 @@ def get_image_data(image_filename, min_lat, min_long, max_lat, max_long, cache_d
     """
     log = GetLogger()
 
-    if (cache_dir / image_filename).exists():
+    output_file = cache_dir / image_filename
+    if output_file.exists():
         log.info(f"Using cached image file {image_filename}")
         return
 
     # Make a list of image tiles we need to cover this region and download them
     tile_coords = get_image_tile_range(min_lat, min_long, max_lat, max_long)
-    image_files = []
-    for lat, long in tile_coords:
-        try:
-            tile_file = download_image_tile(lat, long, cache_dir)
-        except (requests.HTTPError, requests.ConnectionError, requests.Timeout) as ex:
-            raise ApplicationError(f"Error downloading image: {ex}.\nTry checking your internet connection, or check https://www.sciencebase.gov/catalog/status and https://apps.nationalmap.gov/services-checker/#/uptime") from ex
-        image_files.append(tile_file)
+    try:
+        image_files = download_tiles(download_image_tile, tile_coords, cache_dir)
+    except (requests.HTTPError, requests.ConnectionError, requests.Timeout) as ex:
+        raise ApplicationError(f"Error downloading image: {ex}.\nTry checking your internet connection, or check https://www.sciencebase.gov/catalog/status and https://apps.nationalmap.gov/services-checker/#/uptime") from ex
 
     # Create a virtual data source with all of the tiles
-    file_list = " ".join(str(f) for f in image_files)
-    log.debug(f"Creating virtual data set with tiles [{file_list}]")
-    _, crop_input_file = tempfile.mkstemp()
-    retcode, _, stderr = Shell(f"gdalbuildvrt {crop_input_file} {file_list}")
-    if retcode != 0 or "ERROR" in stderr:
-        raise ApplicationError(f"Could not merge input files: {stderr}")
+    log.debug("Creating virtual data set with tiles %s", image_files)
+    crop_input_file = create_virtual_dataset(image_files)
 
     # Crop to the requested region and convert to geotiff
     log.info("Converting and cropping image data")
-    convert_and_crop_raster(crop_input_file, cache_dir / image_filename, min_lat, min_long, max_lat, max_long, remove_alpha=True)
+    convert_and_crop_raster(crop_input_file, output_file, min_lat, min_long, max_lat, max_long, remove_alpha=True, compress=True)
@@ -13,6 +13,8 @@
 ##    to post-process using blender)
 ##  * Fix scaling of the model (I might have caused this with other changes,
 ##    but I am fixing it with a a scale instruction in the final output)
+##  * Calculate the points and faces with NumPy array operations instead of
+##    looping over every pixel, which was far too slow for large DEMs
 
 import os
 import sys
@@ -25,7 +27,6 @@ import numpy as np
 
 from pyapputil.logutil import GetLogger
 
-from util import ProgressTracker
 
 def read_dem(filepath):
     """
@@ -44,7 +45,7 @@ def read_dem(filepath):
     dem_xmax = dem_xmin + dem_tmp_cols * dem_xres
     dem_ymin = dem_ymax - dem_tmp_rows * dem_yres
     dem_band = dem_dataset.GetRasterBand(1)
-    dem_tmp_array = dem_band.ReadAsArray(0, 0, dem_tmp_cols, dem_tmp_rows).astype(np.float32)
+    dem_tmp_array = dem_band.ReadAsArray(0, 0, dem_tmp_cols, dem_tmp_rows).astype(np.float32, copy=False)
     # dem_nodata = dem_band.GetNoDataValue()
     # dem_xcent = (dem_xmin + dem_xmax) / 2.0
     # dem_ycent = (dem_ymin + dem_ymax) / 2.0
@@ -85,7 +86,21 @@ def read_dem(filepath):
 
     return dem_array, dem_cols, dem_rows, dem_xmin, dem_ymax, dem_xres, dem_yres, dem_xdist, dem_ydist
 
-def generate_terrain(dem_filepath, z_scale=2.0, clippoly_filepath=None, zmean_total=0):
+def write_list(out_file, array, to_list, chunk_size=100000):
+    """
+    Write the rows of an array in the same format as str() of a list, a chunk at a time
+    """
+    out_file.write('[')
+    for start in range(0, len(array), chunk_size):
+        if start > 0:
+            out_file.write(', ')
+        out_file.write(str(to_list(array[start:start + chunk_size]))[1:-1])
+    out_file.write(']')
+
+def generate_terrain(dem_filepath, scad_file, z_scale=2.0, clippoly_filepath=None, zmean_total=0):
+    """
+    Write an OpenSCAD polyhedron for the DEM to scad_file, a file opened for writing text
+    """
     log = GetLogger()
 
     # polygon_extrude_height = 10000.0
@@ -116,199 +131,96 @@ def generate_terrain(dem_filepath, z_scale=2.0, clippoly_filepath=None, zmean_to
 
 
 
-    c = []
-
-
     log.debug(f"nanmin {np.nanmin(dem_array)}")
     dem_array = np.copy(dem_array-zmean_total)
     log.debug(f"nanmin {np.nanmin(dem_array)}")
 
 
-    polyhedron_points = []
-    # polyhedron_points_floor = []
-    # polyhedron_points_ceil = []
-    # polyhedron_faces = []
-    polyhedron_faces_array = np.zeros((dem_rows,dem_cols,16,3), dtype=np.int32)
-    # polyhedron_faces_clean_array = np.zeros((dem_rows,dem_cols,16,3), dtype=np.int32)
-    polyhedron_points_floor_array = np.zeros((dem_rows*dem_cols,3), dtype=np.float32)
-    #polyhedron_points_ceil_array = np.zeros((dem_rows*dem_cols,3), dtype=np.float32)
-
-    dem_x_min = None
-    dem_x_max = None
-    dem_y_min = None
-    dem_y_max = None
-
-
-    #for i in range(dem_rows,-1,-1):
+    # Every pixel becomes a point, offset from the center of the extent
     log.info("Calculating polyhedron points floor array...")
-    progress = ProgressTracker(dem_rows * dem_cols)
-    count = 0
-    for i in range(0,dem_rows):
-        for j in range(0,dem_cols):
-            #i0_coord = (dem_ymax - ((dem_yres*-1) * i) - (0.5 * (dem_yres*-1))) - dem_ydist
-            #j0_coord = dem_xmin + (dem_xres * j) + (0.5 * dem_xres)
-
-
-            i0_coord = dem_ymax - (dem_yres * i) #- dem_ydist #- (0.5 * (dem_yres*-1)))
-            j0_coord = dem_xmin + (dem_xres * j) #+ (0.5 * dem_xres)
-
-
-
-            #print(i,j,i0_coord,j0_coord)
-
-            z_a = (dem_array[i][j] * z_scale) #- zmean_total
-
-
-            dem_x = j0_coord
-            dem_y = i0_coord
-
-            polyhedron_points_floor_array[(i*dem_cols)+j][:] = np.array([dem_x - clippoly_layer_extent_xcent, dem_y  - clippoly_layer_extent_ycent, z_a])
-            #polyhedron_points_floor_array[cnt][:] = np.array([j0_coord - clippoly_layer_extent_xcent, i0_coord - clippoly_layer_extent_ycent, z_a])
-
-
-
-            if not dem_x_min or dem_x < dem_x_min:
-                dem_x_min = dem_x
-            if not dem_x_max or dem_x > dem_x_max:
-                dem_x_max = dem_x
-
-            if not dem_y_min or dem_y < dem_y_min:
-                dem_y_min = dem_y
-            if not dem_y_max or dem_y > dem_y_max:
-                dem_y_max = dem_y
-
-
-            #print(dem_rows*dem_cols, cnt, (i*dem_rows)+j, dem_rows, dem_cols, i, j, z_a)
-
-
-            if i<dem_rows-1 and j < dem_cols-1:
-
-                z_b = (dem_array[i+1][j] * z_scale) #- zmean_total
-                z_c = (dem_array[i][j+1] * z_scale) #- zmean_total
-                z_d = (dem_array[i+1][j+1] * z_scale) #- zmean_total
-
-                point_a_ceil = (i*dem_cols)+j
-                point_b_ceil = ((i+1)*dem_cols)+j
-                point_c_ceil = (i*dem_cols)+j+1
-                point_d_ceil = ((i+1)*dem_cols)+j+1
-
-                point_a_floor = (dem_rows*dem_cols) + (i*dem_cols)+j
-                point_b_floor = (dem_rows*dem_cols) + ((i+1)*dem_cols)+j
-                point_c_floor = (dem_rows*dem_cols) + (i*dem_cols)+j+1
-                point_d_floor = (dem_rows*dem_cols) + ((i+1)*dem_cols)+j+1
-
-
-
-                if z_a > -5000 and z_b > -5000 and z_c > -5000:
-
-
-                    polyhedron_faces_array[i][j][0][:] = np.array([point_c_ceil, point_b_ceil, point_a_ceil])     ## ceiling
-                    polyhedron_faces_array[i][j][1][:] = np.array([point_b_floor, point_a_floor, point_a_ceil])   ## left sidev
-                    polyhedron_faces_array[i][j][2][:] = np.array([point_b_ceil, point_b_floor, point_a_ceil])
-                    polyhedron_faces_array[i][j][3][:] = np.array([point_c_floor, point_b_floor, point_b_ceil])   ## right side (diagonal)
-                    polyhedron_faces_array[i][j][4][:] = np.array([point_c_ceil, point_c_floor, point_b_ceil])
-                    polyhedron_faces_array[i][j][5][:] = np.array([point_a_floor, point_c_floor, point_c_ceil])   ## top side
-                    polyhedron_faces_array[i][j][6][:] = np.array([point_a_ceil, point_a_floor, point_c_ceil])
-                    polyhedron_faces_array[i][j][7][:] = np.array([point_a_floor, point_b_floor, point_c_floor])  ## floor
-
-
-
-
-                if z_b > -5000 and z_d > -5000 and z_c > -5000:
-
-                    polyhedron_faces_array[i][j][8][:] = np.array([point_c_ceil, point_d_ceil, point_b_ceil])     ## ceiling
-                    polyhedron_faces_array[i][j][9][:] = np.array([point_d_ceil, point_d_floor, point_b_floor])   ## bottom side
-                    polyhedron_faces_array[i][j][10][:] = np.array([point_d_ceil, point_b_floor, point_b_ceil])
-                    polyhedron_faces_array[i][j][11][:] = np.array([point_c_ceil, point_c_floor, point_d_floor])   ## right side
-                    polyhedron_faces_array[i][j][12][:] = np.array([point_c_ceil, point_d_floor, point_d_ceil])
-                    polyhedron_faces_array[i][j][13][:] = np.array([point_b_ceil, point_b_floor, point_c_floor])   ## left side (diagonal)
-                    polyhedron_faces_array[i][j][14][:] = np.array([point_c_ceil, point_b_ceil, point_c_floor])
-                    polyhedron_faces_array[i][j][15][:] = np.array([point_b_floor, point_d_floor, point_c_floor])  ## floor
-
-            count += 1
-            progress.update(count)
-
-    log.debug(polyhedron_points_floor_array[-1])
-
-
-    polyhedron_faces_clean = []
-
-
+    i0_coords = dem_ymax - (dem_yres * np.arange(dem_rows))
+    j0_coords = dem_xmin + (dem_xres * np.arange(dem_cols))
+    z_array = dem_array.astype(np.float64) * z_scale
+    polyhedron_points_floor_array = np.empty((dem_rows, dem_cols, 3), dtype=np.float32)
+    polyhedron_points_floor_array[:, :, 0] = (j0_coords - clippoly_layer_extent_xcent)[np.newaxis, :]
+    polyhedron_points_floor_array[:, :, 1] = (i0_coords - clippoly_layer_extent_ycent)[:, np.newaxis]
+    polyhedron_points_floor_array[:, :, 2] = z_array
+    polyhedron_points_floor_array = polyhedron_points_floor_array.reshape(-1, 3)
+
+    dem_x_min = j0_coords.min()
+    dem_x_max = j0_coords.max()
+    dem_y_min = i0_coords.min()
+    dem_y_max = i0_coords.max()
+
+    # Each cell between four neighboring pixels a b / c d gets 16 faces, as indexes into the points. The first 8 are
+    # for the a,b,c triangle and the second 8 for the b,d,c triangle, and each set is only used if all of its corners
+    # have valid elevation data
+    point_a_ceil = np.arange(dem_rows * dem_cols).reshape(dem_rows, dem_cols)[:-1, :-1]
+    point_b_ceil = point_a_ceil + dem_cols
+    point_c_ceil = point_a_ceil + 1
+    point_d_ceil = point_b_ceil + 1
+    floor_offset = dem_rows * dem_cols
+    corners = np.stack([point_a_ceil,
+                        point_b_ceil,
+                        point_c_ceil,
+                        point_d_ceil,
+                        point_a_ceil + floor_offset,
+                        point_b_ceil + floor_offset,
+                        point_c_ceil + floor_offset,
+                        point_d_ceil + floor_offset], axis=-1).astype(np.int32)
+    pa, pb, pc, pd, pa_floor, pb_floor, pc_floor, pd_floor = range(8)
+    face_corners = np.array([[pc, pb, pa],                      ## ceiling
+                             [pb_floor, pa_floor, pa],          ## left sidev
+                             [pb, pb_floor, pa],
+                             [pc_floor, pb_floor, pb],          ## right side (diagonal)
+                             [pc, pc_floor, pb],
+                             [pa_floor, pc_floor, pc],          ## top side
+                             [pa, pa_floor, pc],
+                             [pa_floor, pb_floor, pc_floor],    ## floor
+                             [pc, pd, pb],                      ## ceiling
+                             [pd, pd_floor, pb_floor],          ## bottom side
+                             [pd, pb_floor, pb],
+                             [pc, pc_floor, pd_floor],          ## right side
+                             [pc, pd_floor, pd],
+                             [pb, pb_floor, pc_floor],          ## left side (diagonal)
+                             [pc, pb, pc_floor],
+                             [pb_floor, pd_floor, pc_floor]])   ## floor
+    cell_faces = corners[:, :, face_corners]
+
+    z_a = z_array[:-1, :-1]
+    z_b = z_array[1:, :-1]
+    z_c = z_array[:-1, 1:]
+    z_d = z_array[1:, 1:]
+    cell_faces[~((z_a > -5000) & (z_b > -5000) & (z_c > -5000)), :8] = 0
+    cell_faces[~((z_b > -5000) & (z_d > -5000) & (z_c > -5000)), 8:] = 0
+
+    # Keep only the faces that are not shared with a neighboring cell, in any vertex order. Shared faces can only come
+    # from neighboring cells, so counting over the whole mesh gives the same result as checking each neighborhood.
+    # The last row and column of pixels have no cells, so their faces would all be empty and are never stored
     log.info("Calculating polyhedron faces...")
-    count = 0
-    progress = ProgressTracker(dem_rows * dem_cols)
-    for i in range(0,dem_rows):
-        for j in range(0,dem_cols):
-
-
-            for polyhedron_face_id in range(0, 16):
-
-                polyhedron_face = polyhedron_faces_array[i][j][polyhedron_face_id][:].tolist()
-                polyhedron_face_cnt = 0
-
-
-                if not (polyhedron_face[0] == 0 and polyhedron_face[1] == 0 and polyhedron_face[2] == 0):
-
-                    i_bottom = i - 1 if i > 0 else 0
-                    i_top = i + 1 if i < dem_rows-1 else dem_rows-1
-                    j_left = j - 1 if i > 0 else 0
-                    j_right = j + 1 if j < dem_cols-1 else dem_cols
-
-
-                    for i_neighbour in range(i_bottom, i_top+1):
-                        for j_neighbour in range(j_left, j_right+1):
-
-                            array1 = np.array([polyhedron_face[0], polyhedron_face[1], polyhedron_face[2]])
-                            array2 = np.array([polyhedron_face[0], polyhedron_face[2], polyhedron_face[1]])
-                            array3 = np.array([polyhedron_face[1], polyhedron_face[0], polyhedron_face[2]])
-                            array4 = np.array([polyhedron_face[1], polyhedron_face[2], polyhedron_face[0]])
-                            array5 = np.array([polyhedron_face[2], polyhedron_face[1], polyhedron_face[0]])
-                            array6 = np.array([polyhedron_face[2], polyhedron_face[0], polyhedron_face[1]])
-
-                            loc1 = np.where(np.all(polyhedron_faces_array[i_neighbour][j_neighbour][:]==array1, axis=1))
-                            loc2 = np.where(np.all(polyhedron_faces_array[i_neighbour][j_neighbour][:]==array2, axis=1))
-                            loc3 = np.where(np.all(polyhedron_faces_array[i_neighbour][j_neighbour][:]==array3, axis=1))
-                            loc4 = np.where(np.all(polyhedron_faces_array[i_neighbour][j_neighbour][:]==array4, axis=1))
-                            loc5 = np.where(np.all(polyhedron_faces_array[i_neighbour][j_neighbour][:]==array5, axis=1))
-                            loc6 = np.where(np.all(polyhedron_faces_array[i_neighbour][j_neighbour][:]==array6, axis=1))
-
-                            polyhedron_face_neighbour_cnt = len(loc1[0]) + len(loc2[0]) + len(loc3[0]) + len(loc4[0]) + len(loc5[0]) + len(loc6[0])
-                            polyhedron_face_cnt += polyhedron_face_neighbour_cnt
-
-                    if polyhedron_face_cnt == 1:
-
-                        polyhedron_faces_clean.append(polyhedron_face)
-
-                    else:
-                        pass
-            count += 1
-            progress.update(count)
-
-    polyhedron_points = []
-
-    for l in [0]:
-        for polyhedron_point_id in range(0, polyhedron_points_floor_array.shape[0]):
-
-            polyhedron_point = [polyhedron_points_floor_array[polyhedron_point_id][0],
-              polyhedron_points_floor_array[polyhedron_point_id][1],
-              polyhedron_points_floor_array[polyhedron_point_id][2]-(l*10.0)]
-
-            #print(polyhedron_point)
-            polyhedron_points.append(polyhedron_point)
-
+    all_faces = cell_faces.reshape(-1, 3)
+    all_faces = all_faces[all_faces.any(axis=1)]
+    _, face_inverse, face_counts = np.unique(np.sort(all_faces, axis=1), axis=0, return_inverse=True, return_counts=True)
+    polyhedron_faces_clean = all_faces[face_counts[face_inverse.ravel()] == 1]
 
     log.debug(f'dem_extent: {dem_x_min}, {dem_y_min}, {dem_x_max}, {dem_y_max}')
     log.debug(clippoly_layer_extent_xcent, clippoly_layer_extent_ycent)
-    log.debug(f'points {len(polyhedron_points)}')
-    log.debug(f'faces {polyhedron_faces_array.shape[0]}')
+    log.debug(f'points {len(polyhedron_points_floor_array)}')
+    log.debug(f'faces {len(all_faces)}')
     log.debug(f'faces_clean {len(polyhedron_faces_clean)}')
 
-    c.append('module dem() {')
-    c.append('   scale([1000, 1000, 0.01])')
-    c.append(f'    polyhedron(points={polyhedron_points}, faces={polyhedron_faces_clean});')
-    c.append('}')
+    # Stream the polyhedron out in chunks instead of building the whole thing as one string in memory. Keep x,y as
+    # float32 and z as a double of the float32 value, so the points are written out the same way as before
+    scad_file.write('module dem() {\n')
+    scad_file.write('   scale([1000, 1000, 0.01])\n')
+    scad_file.write('    polyhedron(points=')
+    write_list(scad_file, polyhedron_points_floor_array, lambda points: [[x, y, float(z)] for x, y, z in points])
+    scad_file.write(', faces=')
+    write_list(scad_file, polyhedron_faces_clean, lambda faces: faces.tolist())
+    scad_file.write(');\n')
+    scad_file.write('}\n')
 
-    c.append('dem();')
+    scad_file.write('dem();\n')
 
 
 
@@ -402,7 +314,6 @@ def generate_terrain(dem_filepath, z_scale=2.0, clippoly_filepath=None, zmean_to
 
     # from operator import itemgetter
 
-    return c
 
 
 if __name__ == "__main__":
@@ -417,10 +328,8 @@ if __name__ == "__main__":
     # clippoly_filepath = os.path.join(os.sep, 'mnt', 'e', 'zh', 'wambachers_osm__boundaries__adm', 'data', 'district_zurich_al6_al6_2056.shp')
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('--dem_path', action='store', type=str, required=True)
-    parser.add_argument('--dem_prefix', action='store', type=str, required=True)
-    parser.add_argument('--dem_tilex', action='store', type=str, required=False)
-    parser.add_argument('--dem_tiley', action='store', type=str, required=False)
+    parser.add_argument('--dem_file', action='store', type=str, required=True)
+    parser.add_argument('--z_scale', action='store', type=float, required=False, default=2.0)
     parser.add_argument('--zmin', action='store', type=str, required=False)
     parser.add_argument('--zmax', action='store', type=str, required=False)
     parser.add_argument('--clippoly', action='store', type=str, required=True)
@@ -428,30 +337,24 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    dem_dirpath = args.dem_path
-    dem_prefix = args.dem_prefix
-    dem_tilex = args.dem_tilex
-    dem_tiley = args.dem_tiley
+    dem_filepath = args.dem_file
     clippoly_filepath = args.clippoly
     proc_dirpath = args.outdir
     #sys.exit()
-    #dem_dirpath, dem_filename = os.path.split(dem_filepath)
-    #dem_filename_base = dem_filename.split('.')[0]
+    dem_filename = os.path.basename(dem_filepath)
+    dem_filename_base = dem_filename.split('.')[0]
     scad_dirpath = args.outdir
 
-    scad_filename_base = dem_prefix #"_".join([dem_prefix, dem_tiley, dem_tilex])
+    scad_filename_base = dem_filename_base
     try:
         zmin_total = float(args.zmin)
         zmax_total = float(args.zmax)
         zmean_total = zmin_total + ((zmax_total - zmin_total) / 2.0)
-    except ValueError:
+    except (TypeError, ValueError):
         zmean_total = 0
 
-    terrain_command_lines = generate_terrain(clippoly_filepath, dem_dirpath, dem_prefix, dem_tilex, dem_tiley, zmean_total)
-
     with open(os.path.join(scad_dirpath, scad_filename_base + '.scad'), 'w', encoding='utf-8') as scad_file:
-        for command_line in terrain_command_lines:
-            scad_file.write(command_line + '\n')
+        generate_terrain(dem_filepath, scad_file, z_scale=args.z_scale, clippoly_filepath=clippoly_filepath, zmean_total=zmean_total)
 
 
 
@@ -9,22 +9,26 @@ from pyapputil.argutil import ArgumentParser
 from pyapputil.typeutil import ValidateAndDefault, StrType
 from pyapputil.logutil import GetLogger, logargs
 from pyapputil.exceptutil import ApplicationError, InvalidArgumentError
+import numpy as np
 import bpy
 import bmesh #type: ignore #pylint: disable=import-error
-from mathutils import Euler, Vector #type: ignore #pylint: disable=import-error
+from mathutils import Euler #type: ignore #pylint: disable=import-error
 
 from blender_util import (
     ModeSet,
+    add_image_material,
     set_top_view,
     set_zoomed_view,
     set_rendered_view,
     project_uv,
     get_view3d_area_region,
+    get_view3d_override,
     get_side_faces,
     deselect_all,
     extrude_and_flatten,
     select_obj,
     get_obj_dimensions,
+    get_vertex_coords,
     resize_obj,
     simplify_faces
 )
@@ -122,7 +126,7 @@ def internal_create_model(mesh_file,
 
     # Add thickness
     log.info("Extruding and flattening bottom")
-    obj = select_obj()
+    # The object is still active and selected from the import, transform_apply in resize_obj doesn't change that
     extrude_and_flatten(obj, min_thickness)
 
     # Make the sides of the model a single face each
@@ -132,11 +136,9 @@ def internal_create_model(mesh_file,
     log.info("Normalizing object to Z=0 plane")
     log.debug(f"location = {obj.location.z}")
     log.debug(f"w location = {(obj.matrix_world @ obj.location).z}")
-    lowest_z = None
-    for vert in obj.data.vertices:
-        v_world = obj.matrix_world @ Vector((vert.co[0],vert.co[1],vert.co[2]))
-        if lowest_z is None or lowest_z > v_world[2]:
-            lowest_z = v_world[2]
+    # Only the Z row of the world matrix is needed to find the lowest point
+    world_z_row = np.array(obj.matrix_world, dtype=np.float64)[2]
+    lowest_z = float((get_vertex_coords(obj) @ world_z_row[:3]).min() + world_z_row[3])
     obj.location.z = obj.location.z - lowest_z
 
     log.info(f"Saving model to {output_path}")
@@ -144,25 +146,11 @@ def internal_create_model(mesh_file,
 
     log.info("Creating textures")
     # Create a material from the sat image
-    map_tex = bpy.data.materials.new("map")
-    map_tex.use_nodes = True
-    bpy.ops.object.material_slot_add()
-    bpy.context.object.active_material = map_tex
-    map_tex_img = map_tex.node_tree.nodes.new('ShaderNodeTexImage')
-    map_tex_img.image = bpy.data.images.load(f"//{map_image}")
-    bsdf = map_tex.node_tree.nodes["Principled BSDF"]
-    map_tex.node_tree.links.new(bsdf.inputs['Base Color'], map_tex_img.outputs['Color'])
+    add_image_material(obj, "map", map_image)
     log.info(f"Created map texture {map_image}")
 
     # Create a material from the background
-    background_tex = bpy.data.materials.new("back")
-    background_tex.use_nodes = True
-    bpy.ops.object.material_slot_add()
-    bpy.context.object.active_material = background_tex
-    back_tex_img = background_tex.node_tree.nodes.new('ShaderNodeTexImage')
-    back_tex_img.image = bpy.data.images.load(f"//{background_image}")
-    bsdf = background_tex.node_tree.nodes["Principled BSDF"]
-    background_tex.node_tree.links.new(bsdf.inputs['Base Color'], back_tex_img.outputs['Color'])
+    back_slot_idx = add_image_material(obj, "back", background_image)
     log.info(f"Created background texture {background_image}")
 
     log.info("UV mapping textures onto model")
@@ -184,31 +172,20 @@ def internal_create_model(mesh_file,
             break
 
     # Setup override for operators
-    area, region = get_view3d_area_region(layout_screen)
-    space = area.spaces[0]
-    override = {}
-    override['window'] = bpy.context.window
-    override['screen'] = layout_screen
-    override['area'] = area
-    override['region'] = region
-    override['scene'] = bpy.context.scene
-    override['space'] = space
+    override = get_view3d_override(layout_screen)
 
     with ModeSet('EDIT'):
         # Select the sides of the object
         bm = bmesh.from_edit_mesh(obj.data)
-        sides = get_side_faces(bm)
+        side_names = ("left","right","front","back","bottom")
+        sides = get_side_faces(obj, bm, side_names)
         bpy.ops.mesh.select_all(override, action='DESELECT')
-        for face_name in ("left","right","front","back","bottom"):
+        for face_name in side_names:
             sides[face_name][0].select_set(True)
         bmesh.update_edit_mesh(obj.data)
 
         # Assign the texture to the selection
-        idx = 1
-        for idx, slot in enumerate(bpy.context.active_object.material_slots):
-            if slot.name == "back":
-                break
-        bpy.context.object.active_material_index = idx
+        bpy.context.object.active_material_index = back_slot_idx
         bpy.ops.object.material_slot_assign()
 
         bpy.ops.mesh.select_all(override, action='DESELECT')
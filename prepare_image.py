@@ -1,24 +1,26 @@
 #!/usr/bin/env python3
 """Crop, convert, and draw a track onto an orthoimage"""
 
+from concurrent.futures import ThreadPoolExecutor
+import os
 from pathlib import Path
 import sys
 import tempfile
 
-from affine import Affine
-import cv2
 from pyapputil.appframework import PythonApp
 from pyapputil.argutil import ArgumentParser
 from pyapputil.typeutil import ValidateAndDefault, OptionalValueType, StrType, BoolType, ItemList, PositiveNonZeroIntegerType, PositiveIntegerType
 from pyapputil.logutil import GetLogger, logargs
 from pyapputil.exceptutil import InvalidArgumentError, ApplicationError
-from pyapputil.shellutil import Shell
-from osgeo import gdal, osr
-import numpy as np
 
-from geo import GPXFile, get_raster_boundaries_gps, convert_and_crop_raster, GDAL_ERROR, get_cropped_image_filename, get_image_data
 from util import Color, MetadataFile
 
+# Largest power of two reduction to read the image at when it is going to be shrunk anyway
+MAX_READ_REDUCTION = 8
+
+# Number of fractional bits in the track coordinates given to cv2, so lines are drawn with sub-pixel accuracy
+TRACK_SHIFT = 4
+
 @logargs
 @ValidateAndDefault({
     # "arg_name" : (arg_type, arg_default)
@@ -77,6 +79,16 @@ def main(gpx_file,
     localargs = locals()
     log = GetLogger()
 
+    # Import GDAL, OpenCV and friends here so --help and bad arguments do not pay for loading them
+    #pylint: disable=import-outside-toplevel
+    from affine import Affine
+    import cv2
+    from osgeo import gdal, osr
+    import numpy as np
+    from geo import GPXFile, clamp_bounds, get_raster_boundaries_gps, convert_and_crop_raster, create_virtual_dataset, GDAL_ERROR, get_cropped_image_filename, get_image_data
+    #pylint: enable=import-outside-toplevel
+    cv2.setNumThreads(cv2.getNumberOfCPUs())
+
     if not output_file.endswith("png"):
         output_file += ".png"
 
@@ -87,18 +99,20 @@ def main(gpx_file,
     metadata = MetadataFile(output_file)
     metadata.add("args", localargs)
 
+    # One GPXFile for both the bounds and the tracks, so the file is only parsed once
+    gpx = GPXFile(gpx_file) if gpx_file else None
+
     # Determine the bounds of the output
-    if gpx_file and None in (min_lat, min_long, max_lat, max_long):
+    if gpx and (min_lat is None or min_long is None or max_lat is None or max_long is None):
         log.info("Parsing GPX file")
-        gpx = GPXFile(gpx_file)
         try:
             min_lat, min_long, max_lat, max_long = gpx.GetBounds(padding, square)
         except ApplicationError as ex:
             log.error(ex)
             return False
-    if None in (min_lat, min_long, max_lat, max_long):
+    if min_lat is None or min_long is None or max_lat is None or max_long is None:
         raise InvalidArgumentError("You must specify an area to crop")
-    log.debug(f"Requested crop boundaries top(max_lat)={max_lat} left(min_long)={min_long} bottom(min_lat)={min_lat} right(max_long)={max_long}")
+    log.debug("Requested crop boundaries top(max_lat)=%s left(min_long)=%s bottom(min_lat)=%s right(max_long)=%s", max_lat, min_long, min_lat, max_long)
     metadata.add("output_bounds_reqested", {"min_lat":min_lat, "min_long":min_long, "max_lat":max_lat, "max_long":max_long})
 
     # If there was no input file specified, first look in the local cache and then try to download appropriate files
@@ -117,15 +131,7 @@ def main(gpx_file,
             input_files = [cache_file]
 
     # Build a virtual data set if there is more than one input file
-    if len(input_files) > 1:
-        log.info("Merging input files into virtual data set")
-        _, input_file = tempfile.mkstemp()
-        # The python interface to this is horrifying, so use the command line app
-        retcode, _, stderr = Shell(f"gdalbuildvrt {input_file} {' '.join(input_files)}")
-        if retcode != 0 or "ERROR" in stderr:
-            raise ApplicationError(f"Could not merge input files: {stderr}")
-    else:
-        input_file = input_files[0]
+    input_file = create_virtual_dataset(input_files)
 
 
     # Open the file
@@ -134,30 +140,20 @@ def main(gpx_file,
 
     # Calculate the extent from the input file
     source_min_lat, source_min_long, source_max_lat, source_max_long = get_raster_boundaries_gps(ds)
-    log.debug(f"Source boundaries top(max_lat)={source_max_lat} left(min_long)={source_min_long} bottom(min_lat)={source_min_lat} right(max_long)={source_max_long}")
+    log.debug("Source boundaries top(max_lat)=%s left(min_long)=%s bottom(min_lat)=%s right(max_long)=%s", source_max_lat, source_min_long, source_min_lat, source_max_long)
     metadata.add("input_bounds", {"min_lat": source_min_lat, "min_long": source_min_long, "max_lat": source_max_lat, "max_long": source_max_long})
 
     # Adjust output crop as necessary to fit the source image
-    adjust = False
-    if min_lat < source_min_lat:
-        min_lat = source_min_lat
-        adjust = True
-    if max_lat > source_max_lat:
-        max_lat = source_max_lat
-        adjust = True
-    if min_long < source_min_long:
-        min_long = source_min_long
-        adjust = True
-    if max_long > source_max_long:
-        max_long = source_max_long
-        adjust = True
-    if adjust:
+    requested = (min_lat, min_long, max_lat, max_long)
+    min_lat, min_long, max_lat, max_long = clamp_bounds(requested, (source_min_lat, source_min_long, source_max_lat, source_max_long))
+    if (min_lat, min_long, max_lat, max_long) != requested:
         log.info("Output boundary is outside of input boundary")
         log.info(f"New crop boundaries top(max_lat)={max_lat} left(min_long)={min_long} bottom(min_lat)={min_lat} right(max_long)={max_long}")
     metadata.add("output_bounds_adjusted", {"min_lat":min_lat, "min_long":min_long, "max_lat":max_lat, "max_long":max_long})
 
     # Convert the image and crop to geo boundaries, save to intermediate file
-    _, intermediate_file = tempfile.mkstemp()
+    fd, intermediate_file = tempfile.mkstemp()
+    os.close(fd)
     convert_and_crop_raster(input_file, intermediate_file, min_lat, min_long, max_lat, max_long, output_type="GTiff", remove_alpha=True)
 
     # Open the intermediate file and determine the projections/transform from GPS coords into the image
@@ -175,47 +171,73 @@ def main(gpx_file,
     gt = src_ds.GetGeoTransform()
     fwd_trans = Affine.from_gdal(*gt)
     rev_trans = ~fwd_trans
-
-    # Load the image into cv2
-    img = cv2.imread(str(input_file))
+    # The top two rows of the reverse transform, to apply it to all of the points of a track at once
+    pixel_matrix = np.array(rev_trans, dtype=np.float64).reshape(3, 3)[:2]
+
+    # If the output is going to be shrunk by 2x or more, read the pixels at a power of two reduction instead of decoding
+    # the whole image and throwing most of it away in the resize. Scale the pixel transform and track width to match
+    reduction = 1
+    read_scale = get_resize_scale(src_ds.RasterXSize, src_ds.RasterYSize, max_width, max_height)
+    while reduction < MAX_READ_REDUCTION and read_scale * reduction * 2 <= 1.0:
+        reduction *= 2
+    read_width = max(1, src_ds.RasterXSize // reduction)
+    read_height = max(1, src_ds.RasterYSize // reduction)
+    if reduction > 1:
+        log.debug("Reading image reduced %sx to xsize=%s, ysize=%s", reduction, read_width, read_height)
+        pixel_matrix[0] *= float(read_width) / float(src_ds.RasterXSize)
+        pixel_matrix[1] *= float(read_height) / float(src_ds.RasterYSize)
+        track_width = max(1, int(round(float(track_width) / reduction)))
+
+    # Load the pixels from the dataset that is already open instead of decoding the file again with cv2. GDAL releases
+    # the GIL while it reads, so parse the GPX tracks at the same time
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pixels_future = executor.submit(src_ds.ReadAsArray,
+                                        buf_xsize=read_width,
+                                        buf_ysize=read_height,
+                                        resample_alg=gdal.GRIORA_Average)
+        tracks = gpx.GetTrackPoints() if draw_track else []
+        pixels = pixels_future.result()
+
+    # Put the pixels in the HxWx3 BGR layout cv2 uses
+    if pixels.ndim == 2:
+        img = cv2.cvtColor(pixels, cv2.COLOR_GRAY2BGR)
+    else:
+        img = np.ascontiguousarray(pixels[2::-1].transpose(1, 2, 0))
 
     # Draw the tracks
     if draw_track:
         log.info("Drawing track on image")
-        gpx = GPXFile(gpx_file)
-        for track in gpx.GetTrackPoints():
+        track_lines = []
+        for track in tracks:
+            if len(track) == 0:
+                continue
 
             # Map GPS coordinates into the coordinate system of the geo image (discarding the z coord)
-            image_points = [(x,y) for x,y,_ in [gps_to_image.TransformPoint(long, lat) for lat, long in track]] # Note the swap in lat/long
-            # log.debug("gps_points[0] = ({})".format(track[0]))
-            # log.debug("image_points[0] = ({})".format(image_points[0]))
+            gps_points = track[:, ::-1] # Note the swap in lat/long
+            image_points = np.array(gps_to_image.TransformPoints(gps_points.tolist()), dtype=np.float64)[:, :2]
 
-            # Map image coordinates into pixel coordinates using affine transform
-            pixel_points = np.array([[rev_trans * (x,y) for x,y in image_points] ], np.int32)
-            # log.debug("pixel_points[0] = ({})".format(pixel_points[0][0]))
+            # Map image coordinates into fixed point pixel coordinates using affine transform
+            pixel_points = image_points @ pixel_matrix[:, :2].T + pixel_matrix[:, 2]
+            pixel_points = np.rint(pixel_points * (1 << TRACK_SHIFT)).astype(np.int32)
 
             # Reshape the array into what cv2.polylines wants
-            pixel_points = pixel_points.reshape((-1, 1, 2))
+            track_lines.append(pixel_points.reshape((-1, 1, 2)))
 
-            # Draw the track on the image
-            cv2.polylines(img, [pixel_points], False, track_color.as_bgr(), track_width, cv2.LINE_AA)
+        # Draw all of the tracks on the image in one call
+        if track_lines:
+            cv2.polylines(img, track_lines, False, track_color.as_bgr(), track_width, cv2.LINE_AA, shift=TRACK_SHIFT)
 
     # Resize the image if needed
     (height, width) = img.shape[:2]
-    new_height = height
-    new_width = width
-    if max_width > 0 and new_width > max_width:
-        ratio = float(max_width) / float(new_width)
-        new_width = max_width
-        new_height = int(new_height * ratio)
-    if max_height > 0 and new_height > max_height:
-        ratio = float(new_height) / float(new_height)
-        new_height = max_height
-        new_width = int(new_width * ratio)
+    scale = get_resize_scale(width, height, max_width, max_height)
+    new_width = max(1, int(round(width * scale)))
+    new_height = max(1, int(round(height * scale)))
 
     if new_width != width or new_height != height:
         log.info(f"Resizing image to ({new_width}, {new_height})")
-        img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_CUBIC)
+        # Area averaging is faster and aliases less when shrinking, cubic looks better when enlarging
+        interpolation = cv2.INTER_AREA if new_width * new_height < width * height else cv2.INTER_CUBIC
+        img = cv2.resize(img, (new_width, new_height), interpolation=interpolation)
 
     # Write the target image
     cv2.imwrite(str(output_file), img)
@@ -226,6 +248,10 @@ def main(gpx_file,
     log.passed(f"Successfully wrote {output_file}")
     return True
 
+def get_resize_scale(width, height, max_width, max_height):
+    """Get the single scale factor that fits an image within the max size and keeps the aspect ratio. A max of 0 means unlimited"""
+    return min([1.0] + [float(limit) / float(size) for limit, size in ((max_width, width), (max_height, height)) if limit > 0])
+
 
 if __name__ == '__main__':
     parser = ArgumentParser(description="Crop a spatial image to the given lat/long coordinates and convert it to a GeoTiff")
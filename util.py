@@ -6,6 +6,7 @@ except ImportError:
     import collections
 from datetime import datetime, timezone
 import json
+import os
 from pathlib import Path
 import sys
 from time import time
@@ -14,8 +15,23 @@ from pyapputil.logutil import GetLogger
 from pyapputil.exceptutil import ApplicationError, InvalidArgumentError
 from pyapputil.typeutil import IntegerRangeType, ItemList
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import webcolors
 
+# Number of connections to keep open to each host
+HTTP_POOL_SIZE = 8
+
+# Shared session so repeated requests to the same host reuse connections. Transient server errors are retried with
+# backoff, and the last response is returned instead of raising so callers still get an HTTPError from raise_for_status
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount("https://", HTTPAdapter(pool_connections=HTTP_POOL_SIZE,
+                                           pool_maxsize=HTTP_POOL_SIZE,
+                                           max_retries=Retry(total=5,
+                                                             backoff_factor=0.3,
+                                                             status_forcelist=[502, 503, 504],
+                                                             raise_on_status=False)))
+
 def default_json(obj):
     """Default serializer for json.dumps"""
     if hasattr(obj, 'to_json'):
@@ -60,12 +76,30 @@ def download_file(url, local_file):
     """
     log = GetLogger()
     log.debug("GET %s -> %s", url, local_file)
-    with requests.get(url, stream=True) as res:
+    with HTTP_SESSION.get(url, stream=True, timeout=(10, 1200)) as res:
         res.raise_for_status()
         with open(local_file, "wb") as output:
-            for chunk in res.iter_content(chunk_size=16 * 1024):
+            for chunk in res.iter_content(chunk_size=1024 * 1024):
                 output.write(chunk)
 
+def prefetch_file(filename):
+    """
+    Ask the kernel to start reading a file into the page cache before we
+    need it. This is only a hint and does nothing where posix_fadvise is not
+    available.
+
+    Args:
+        filename:       (Path)   The file that is about to be read.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        # Only WILLNEED outlives this fd. SEQUENTIAL just widens readahead for this open file, not the one GDAL opens later
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    finally:
+        os.close(fd)
+
 def list_like(thing):
     """Check of the argument is an iterable but not a string"""
     return isinstance(thing, collections.Iterable) and not isinstance(thing, str)
@@ -119,7 +153,7 @@ class Color():
                 self.name = color
                 self.rgb = (parsed.red, parsed.green, parsed.blue)
             except ValueError:
-                raise InvalidArgumentError("{color} is not a recognizable color name") #pylint: disable=raise-missing-from
+                raise InvalidArgumentError(f"{color} is not a recognizable color name") #pylint: disable=raise-missing-from
 
         if not self.name:
             try: